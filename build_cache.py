@@ -0,0 +1,111 @@
+# ---------------------------------------------
+# Script: build_cache.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module builds one `ibexopt` binary per parameter configuration and keeps it in a cache
+# directory, so that a configuration is compiled only once and several configurations can be
+# benchmarked at the same time. Each binary lives in its own directory named after a hash of the
+# parameters, the patched header and the Ibex source revision, so an unchanged configuration is
+# never rebuilt, not even across campaigns.
+#
+# FUNCTIONS
+# ---------
+# - `patch_header`: Returns the header source with the given alpha, max_iter and prec values filled in.
+# - `source_revision`: Returns a string identifying the Ibex sources (git commit plus a hash of any local
+#   changes), or an empty string if `ibex_dir` is not a git checkout.
+# - `config_key`: Hashes the parameters, the patched header and the source revision into the cache key.
+# - `build_config`: Returns the cached binary for a configuration, building it first if needed. The header is
+#   patched, `./waf build` is run in the existing Ibex build tree and the freshly built `ibexopt` is copied
+#   into `{cache_dir}/{key}/ibexopt`. The original header is always restored afterwards. The parameters end up in
+#   libibex, so a build whose `ibexopt` loads a shared libibex (Ibex configured with `--enable-shared`) is refused:
+#   all cached binaries would load the same, last built, library.
+# - `shared_libibex`: Returns how a binary loads a shared libibex (as `ldd` shows it), or None if it is linked statically.
+# - `binary_hash`: Returns the cache key of a cached binary, which identifies it in the results database.
+#
+# Builds share the Ibex source tree, so `build_config` must not be called concurrently; run.py runs
+# it from a single background thread.
+# ---------------------------------------------
+
+import os
+import shutil
+import hashlib
+import subprocess
+
+
+def patch_header(source, alpha, max_iter, prec):
+    source = source.replace("double alpha=", f"double alpha={alpha}")
+    source = source.replace("int max_iter=", f"int max_iter={max_iter}")
+    source = source.replace("double prec=", f"double prec={prec}")
+    return source
+
+
+def source_revision(ibex_dir):
+    try:
+        commit = subprocess.run(["git", "-C", ibex_dir, "rev-parse", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        diff = subprocess.run(["git", "-C", ibex_dir, "diff", "HEAD"],
+                              capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return f"{commit}-{hashlib.sha256(diff).hexdigest()[:16]}"
+
+
+def config_key(header_source, revision, alpha, max_iter, prec):
+    digest = hashlib.sha256()
+    digest.update(f"alpha={alpha} max_iter={max_iter} prec={prec}\n".encode())
+    digest.update(revision.encode())
+    digest.update(patch_header(header_source, alpha, max_iter, prec).encode())
+    return digest.hexdigest()[:16]
+
+
+def build_config(ibex_dir, header_file, ibexopt, cache_dir, revision, alpha, max_iter, prec, build_jobs=None):
+    with open(header_file, "r") as file:
+        header_source = file.read()
+
+    key = config_key(header_source, revision, alpha, max_iter, prec)
+    config_dir = os.path.join(cache_dir, key)
+    binary = os.path.join(config_dir, "ibexopt")
+    if os.path.exists(binary):
+        return binary
+
+    os.makedirs(config_dir, exist_ok=True)
+    cmd = ["./waf", "build"] + ([f"-j{build_jobs}"] if build_jobs else [])
+    try:
+        with open(header_file, "w") as file:
+            file.write(patch_header(header_source, alpha, max_iter, prec))
+        with open(os.path.join(config_dir, "waf_build.log"), "w") as log:
+            subprocess.run(cmd, cwd=ibex_dir, stdout=log, stderr=subprocess.STDOUT, check=True)
+    finally:
+        with open(header_file, "w") as file:
+            file.write(header_source)
+
+    library = shared_libibex(ibexopt)
+    if library:
+        raise RuntimeError(f"{ibexopt} is linked against a shared libibex ({library}): the parameters are compiled into libibex, so every "
+                           f"cached binary would run with the last configuration built. Configure Ibex without "
+                           f"--enable-shared so that libibex is linked statically.")
+    # Copy under a temporary name first so an interrupted copy never looks like a cached binary
+    shutil.copy2(ibexopt, binary + ".tmp")
+    os.replace(binary + ".tmp", binary)
+    return binary
+
+
+def shared_libibex(binary):
+    try:
+        result = subprocess.run(["ldd", binary], capture_output=True, text=True)
+    except OSError:
+        # Without ldd, the name of the shared library is still in the binary's list of needed libraries
+        with open(binary, "rb") as file:
+            return "libibex.so" if b"libibex.so" in file.read() else None
+    # ldd fails on static binaries ("not a dynamic executable"), which is what we want
+    for line in result.stdout.splitlines():
+        if "libibex" in line:
+            return line.split("(")[0].strip()
+    return None
+
+
+def binary_hash(binary):
+    # Cached binaries live in a directory named after their cache key
+    return os.path.basename(os.path.dirname(binary))
@@ -0,0 +1,238 @@
+# ---------------------------------------------
+# Script: coordinator.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module lets run.py spread a campaign over several machines. In distributed mode run.py keeps
+# building the binaries and recording the results, but instead of running the jobs itself it hands
+# them to a `Coordinator`, which serves them to workers (`worker.py`) connecting over TCP. A worker
+# fetches a job, downloads the configuration's `ibexopt` binary and the benchmark file if it does
+# not have them yet, runs the job and sends back the parsed summary.
+#
+# Every job a worker fetches is leased to it for `lease_seconds`. The worker renews the lease while
+# the job runs; a job whose lease runs out (the worker crashed, lost its network or was shut down)
+# is put back at the front of the queue and given to the next worker that asks. The first result
+# that arrives for a job is kept, any later one is ignored. A job that a worker could not run (a failed
+# download, a binary that does not execute on that host, a full disk) is put back at the end of the
+# queue, up to `retries` times, and given to another worker if one has been in touch within the lease time; after that it is reported to run.py as a failed run, so that one broken
+# worker cannot stop the campaign.
+#
+# PROTOCOL
+# --------
+# Each request is a single JSON object on one line, sent over a new connection, and answered with a
+# single JSON object on one line:
+# Every request also carries the coordinator's `"token"`, if it has one, and is refused otherwise.
+# - `{"type": "fetch", "worker": name, "pinned": bool}`: Returns the next job (`"type": "job"`, see `lease_job`), `"wait"` if
+#   the queue is empty for now, or `"done"` once the campaign is over. A worker that does not pin its jobs
+#   gets an error if the campaign was started with `pin_jobs`, and the other way round, so that the runs are
+#   recorded with the right `pinned` flag.
+# - `{"type": "renew", "worker": name, "id": job}`: Extends the lease of a running job. `ok` is false if the
+#   lease was lost.
+# - `{"type": "result", "worker": name, "id": job, "result": summary}`: Reports the result of a job, or
+#   `"error"` instead of `"result"` if it could not be run, in which case the job is queued again.
+# - `{"type": "binary", "name": binary_hash}` and `{"type": "bench", "name": bench}`: Return the base64
+#   encoded content of a binary or benchmark file used by a queued job.
+# The token is a shared secret that keeps other hosts from fetching jobs, reporting results or downloading files,
+# but it is sent in clear like everything else, so the coordinator should still only listen on a trusted network
+# (or be reached through an SSH tunnel). Without a token, the coordinator refuses to listen beyond loopback.
+#
+# FUNCTIONS
+# ---------
+# - `Coordinator`: Job queue with the `submit` / context manager interface of the thread pool run.py uses
+#   locally. `submit` returns a `concurrent.futures.Future` that completes when a worker reports the result,
+#   so run.py waits on local and remote jobs the same way, and racing mode can cancel jobs that have not
+#   been fetched yet. `shutdown(cancel_futures=True)` cancels every job no worker has fetched yet. The job's
+#   cutoff is computed by the `cutoff` function when the job is leased, so it uses the latest baseline times. With `archive`, the name of the campaign, workers store the raw outputs in an
+#   archive of that name (see `output_archive.py`) instead of one text file per run. `retries` is the number of
+#   times a job is queued again after a worker error. Raises a ValueError if
+#   `address` is not a loopback address and no `token` is given.
+# ---------------------------------------------
+
+import os
+import hmac
+import json
+import time
+import base64
+import itertools
+import threading
+import ipaddress
+import collections
+import socketserver
+from concurrent.futures import Future
+from build_cache import binary_hash
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.coordinator.handle(request)
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            response = {"type": "error", "error": f"bad request: {error}"}
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class Coordinator:
+    def __init__(self, address, bench_dir, lease_seconds, cutoff, pinned=False, archive=None, token=None, retries=2):
+        self.bench_dir = bench_dir
+        self.pinned = pinned
+        self.archive = archive
+        self.lease_seconds = lease_seconds
+        self.cutoff = cutoff
+        self.token = token
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.jobs = {}  # job id -> (job, baseline_times, future) of jobs without a result yet
+        self.queued = collections.deque()  # job ids in the order they are handed out
+        self.leases = {}  # job id -> (worker, deadline)
+        self.failures = collections.Counter()  # job id -> errors reported by workers
+        self.failed_by = collections.defaultdict(set)  # job id -> workers that reported an error for it
+        self.last_seen = {}  # worker -> time of its last request
+        self.files = {"binary": {}, "bench": {}}  # name -> local path of the files workers may download
+        self.closing = False
+        self.server = CoordinatorServer(address, RequestHandler)
+        if token is None and not ipaddress.ip_address(self.server.server_address[0]).is_loopback:
+            # Anyone who can reach the port could otherwise download the binaries and report made-up results
+            self.server.server_close()
+            raise ValueError(f"The coordinator listens on {self.server.server_address[0]}, beyond loopback: set coordinator_token "
+                             f"and start the workers with --token")
+        self.server.coordinator = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        print(f"Coordinator listening on {self.server.server_address[0]}:{self.server.server_address[1]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, job, baseline_times):
+        file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary = job
+        future = Future()
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.jobs[job_id] = (job, baseline_times, future)
+            self.queued.append(job_id)
+            self.files["binary"][binary_hash(binary)] = binary
+            self.files["bench"][file_path] = os.path.join(self.bench_dir, f"{file_path}.bch")
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        # Same signature as ThreadPoolExecutor.shutdown; the jobs run on the workers, so there is nothing to wait for
+        with self.lock:
+            if self.closing:
+                return
+            # Workers asking for a job from now on are told to stop
+            self.closing = True
+            if cancel_futures:
+                for job_id in self.queued:
+                    if job_id in self.jobs:
+                        self.jobs[job_id][2].cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        if self.token is not None and not hmac.compare_digest(str(request.get("token")).encode(), self.token.encode()):
+            return {"type": "error", "error": "invalid token"}
+        if "worker" in request:
+            with self.lock:
+                self.last_seen[request["worker"]] = time.monotonic()
+        handlers = {"fetch": self.lease_job, "renew": self.renew_lease, "result": self.finish_job,
+                    "binary": self.send_file, "bench": self.send_file}
+        if request.get("type") not in handlers:
+            return {"type": "error", "error": f"unknown request type {request.get('type')!r}"}
+        return handlers[request["type"]](request)
+
+    def lease_job(self, request):
+        worker = request["worker"]
+        if bool(request.get("pinned")) != self.pinned:
+            setup = "pinned" if self.pinned else "unpinned"
+            return {"type": "error", "error": f"this campaign records {setup} runs, start the worker with{'' if self.pinned else 'out'} --pin_jobs"}
+        with self.lock:
+            self.requeue_expired()
+            now = time.monotonic()
+            others = any(name != worker and now - seen < self.lease_seconds for name, seen in self.last_seen.items())
+            while self.queued:
+                job_id = next((job_id for job_id in self.queued if worker not in self.failed_by.get(job_id, ())), None)
+                if job_id is None:
+                    # Only jobs this worker could not run are left: they wait for another worker, if there is one,
+                    # so that a broken worker does not use up their retries
+                    if others:
+                        break
+                    job_id = self.queued[0]
+                self.queued.remove(job_id)
+                if job_id not in self.jobs:
+                    continue
+                job, baseline_times, future = self.jobs[job_id]
+                # A job that was never leased before can have been cancelled by racing mode in the meantime
+                if not future.running() and not future.set_running_or_notify_cancel():
+                    del self.jobs[job_id]
+                    continue
+                self.leases[job_id] = (worker, time.monotonic() + self.lease_seconds)
+                file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary = job
+                return {"type": "job", "id": job_id, "bench": file_path, "run": run, "seed": loop_number,
+                        "is_baseline": is_baseline, "alpha": alpha, "max_iter": max_iter, "prec": prec,
+                        "binary_hash": binary_hash(binary), "cutoff": self.cutoff(file_path, is_baseline, baseline_times),
+                        "lease_seconds": self.lease_seconds, "archive": self.archive}
+            return {"type": "done" if self.closing else "wait"}
+
+    def requeue_expired(self):
+        now = time.monotonic()
+        for job_id, (worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[job_id]
+                # Re-queued jobs go first, they have already waited their turn once
+                self.queued.appendleft(job_id)
+                print(f"Lease of job {job_id} ({self.jobs[job_id][0][0]}) on worker {worker} expired, queueing it again")
+
+    def renew_lease(self, request):
+        with self.lock:
+            lease = self.leases.get(request["id"])
+            if lease is None or lease[0] != request["worker"]:
+                return {"type": "renew", "ok": False}
+            self.leases[request["id"]] = (lease[0], time.monotonic() + self.lease_seconds)
+            return {"type": "renew", "ok": True}
+
+    def finish_job(self, request):
+        job_id = request["id"]
+        with self.lock:
+            if job_id not in self.jobs:
+                # Another worker already reported this job after its lease had been moved
+                return {"type": "result", "ok": False}
+            self.leases.pop(job_id, None)
+            if "error" in request:
+                self.failures[job_id] += 1
+                self.failed_by[job_id].add(request["worker"])
+                print(f"Worker {request['worker']} could not run job {job_id} ({self.jobs[job_id][0][0]}): {request['error']}")
+                if self.failures[job_id] <= self.retries:
+                    # At the end of the queue, so that another worker is likely to get it; unless its lease had
+                    # already run out and put it back
+                    if job_id not in self.queued:
+                        self.queued.append(job_id)
+                    return {"type": "result", "ok": True}
+            _, _, future = self.jobs.pop(job_id)
+            self.failed_by.pop(job_id, None)
+            attempts = self.failures.pop(job_id, 0)
+        if "error" in request:
+            # Recorded like a run whose output could not be parsed, so the next campaign runs it again
+            print(f"Giving up on job {job_id} after {attempts} failed attempts")
+            future.set_result({"cpu_time": None, "num_cells": None, "timed_out": 0, "cutoff": None, "output_file": None})
+        else:
+            future.set_result(request["result"])
+        return {"type": "result", "ok": True}
+
+    def send_file(self, request):
+        with self.lock:
+            path = self.files[request["type"]].get(request["name"])
+        if path is None:
+            return {"type": "error", "error": f"no {request['type']} named {request['name']!r}"}
+        with open(path, "rb") as file:
+            return {"type": request["type"], "data": base64.b64encode(file.read()).decode()}
@@ -0,0 +1,166 @@
+# ---------------------------------------------
+# Script: cost_model.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module predicts what a campaign costs from the baseline runs recorded in the results database,
+# and builds bench lists that fit a CPU-time budget, in place of hand-curated lists such as
+# `bench_list (easy most)` or `bench_list (medium sub 60)`.
+#
+# The cost of a benchmark is the mean CPU time of its baseline runs over all campaigns, with censored
+# runs counted as `par_k` times their cutoff as everywhere else. Its difficulty, used to spread the
+# selection over easy and hard benchmarks, is the median time, which one slow outlier does not move.
+# The mean and median number of cells are reported alongside. A benchmark that was never run gets the
+# median cost of its family (the directory it is in, e.g. `easy` or `medium`), or of all benchmarks if
+# its family has no history either.
+#
+# A bench list for a budget is built so that it covers every family and the whole difficulty range:
+# the benchmarks of each family are split into `strata` difficulty bands (quantiles of the median time),
+# and one benchmark is taken from each band in turn (the easiest band of every family first), in a shuffled order fixed by `seed`, as long as it
+# fits in what is left of the budget. Each benchmark costs its predicted time times the number of runs
+# the campaign makes of it (`baseline_num_runs + num_runs * number of combinations`).
+#
+# FUNCTIONS
+# ---------
+# - `benchmark_costs`: Returns a pandas DataFrame with the mean and median time and cells, and the number of
+#   recorded baseline runs, of every benchmark with history.
+# - `family`: Returns the family of a benchmark, the directory it is in.
+# - `predict_costs`: Returns the predicted time of one run of each given benchmark, and the benchmarks that
+#   had no history.
+# - `budget_bench_list`: Selects benchmarks whose predicted campaign cost fits a budget in CPU seconds. Raises a
+#   ValueError if the database has no baseline history at all, since nothing could then be predicted.
+# - `predict_wall_time`: Simulates run.py's scheduler (jobs handed out in order to the first free slot) on
+#   predicted job times and returns the time until the last job ends.
+# - `list_benchmarks`: Returns every benchmark of the given families found in Ibex's `benchs/optim` directory.
+# - `main`: Builds a bench list for a budget from the command line and writes it to a file.
+#
+# PARAMETERS
+# ----------
+# - `--results_db`: Path of the results database.
+# - `--bench_dir`: Ibex's `benchs/optim` directory, where the candidate benchmarks are found.
+# - `--families`: Families (subdirectories of `--bench_dir`) to select from, defaults to `easy medium`.
+# - `--budget`: Budget of the campaign in CPU hours.
+# - `--runs_per_bench`: Runs the campaign makes of each benchmark, over the baseline and all combinations.
+# - `--max_jobs`: Number of parallel jobs for the predicted wall time, defaults to the number of CPUs.
+# - `--strata`, `--seed`: Difficulty bands per family, defaults to 3, and seed of the selection, defaults to 0.
+# - `--par_k`: Factor applied to the cutoff of censored runs, defaults to 10.
+# - `--output`: File to write the bench list to, defaults to `bench_list (budget)`.
+# ---------------------------------------------
+
+import os
+import heapq
+import argparse
+import numpy as np
+import pandas as pd
+from multiprocessing import cpu_count
+from results_db import open_results_db
+
+
+def benchmark_costs(conn, par_k=10):
+    runs = pd.read_sql_query("""
+        SELECT bench, CASE WHEN timed_out = 1 THEN ? * cutoff ELSE cpu_time END AS time, num_cells FROM runs
+        WHERE is_baseline = 1 AND (cpu_time IS NOT NULL OR timed_out = 1)""", conn, params=(par_k,))
+    costs = runs.groupby('bench').agg(mean_time=('time', 'mean'), median_time=('time', 'median'),
+                                      mean_cells=('num_cells', 'mean'), median_cells=('num_cells', 'median'),
+                                      runs=('time', 'size'))
+    return costs
+
+
+def family(bench):
+    return os.path.dirname(bench)
+
+
+def predict_costs(costs, benchs):
+    known = costs['mean_time'].to_dict()
+    family_costs = costs['mean_time'].groupby(costs.index.map(family)).median().to_dict()
+    overall = costs['mean_time'].median() if not costs.empty else 0.0
+    unknown = [bench for bench in benchs if bench not in known]
+    return {bench: known.get(bench, family_costs.get(family(bench), overall)) for bench in benchs}, unknown
+
+
+def budget_bench_list(costs, benchs, budget, runs_per_bench, strata=3, seed=0):
+    # Without any baseline history every benchmark would be predicted to cost nothing and the budget would select them all
+    if costs.empty:
+        raise ValueError("No baseline runs in the results database to predict costs from, "
+                         "run a campaign with a bench list first to build up a history")
+    predicted, _ = predict_costs(costs, benchs)
+    difficulty = costs['median_time'].to_dict()
+    rng = np.random.default_rng(seed)
+
+    # Difficulty bands per family; benchmarks without history join the middle band of their family
+    bands = {}
+    for name in sorted({family(bench) for bench in benchs}):
+        members = sorted(bench for bench in benchs if family(bench) == name)
+        times = np.array([difficulty.get(bench, np.nan) for bench in members])
+        known = ~np.isnan(times)
+        band_of = np.full(len(members), strata // 2)
+        if known.any():
+            edges = np.quantile(times[known], np.linspace(0, 1, strata + 1)[1:-1])
+            band_of[known] = np.searchsorted(edges, times[known], side='right')
+        for band in range(strata):
+            band_members = [members[i] for i in np.flatnonzero(band_of == band)]
+            if band_members:
+                bands[(band, name)] = [band_members[i] for i in rng.permutation(len(band_members))]
+    # Each round visits the same band of every family before the next band, so a small budget still covers all families
+    bands = [bands[key] for key in sorted(bands)]
+
+    selected = []
+    remaining = budget
+    while any(bands):
+        for band in bands:
+            while band:
+                bench = band.pop()
+                cost = predicted[bench] * runs_per_bench
+                if cost <= remaining:
+                    selected.append(bench)
+                    remaining -= cost
+                    break
+    return sorted(selected), budget - remaining
+
+
+def predict_wall_time(job_times, num_workers):
+    slots = [0.0] * num_workers
+    for job_time in job_times:
+        heapq.heapreplace(slots, slots[0] + job_time)
+    return max(slots)
+
+
+def list_benchmarks(bench_dir, families):
+    return sorted(f"{name}/{file_name[:-len('.bch')]}" for name in families
+                  for file_name in os.listdir(os.path.join(bench_dir, name)) if file_name.endswith('.bch'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results_db', type=str, required=True)
+    parser.add_argument('--bench_dir', type=str, required=True)
+    parser.add_argument('--families', nargs='+', type=str, default=['easy', 'medium'])
+    parser.add_argument('--budget', type=float, required=True)
+    parser.add_argument('--runs_per_bench', type=int, required=True)
+    parser.add_argument('--max_jobs', type=int, default=cpu_count())
+    parser.add_argument('--strata', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--par_k', type=float, default=10)
+    parser.add_argument('--output', type=str, default='bench_list (budget)')
+    args = parser.parse_args()
+
+    conn = open_results_db(args.results_db)
+    costs = benchmark_costs(conn, args.par_k)
+    conn.close()
+    benchs = list_benchmarks(args.bench_dir, args.families)
+    selected, cost = budget_bench_list(costs, benchs, args.budget * 3600, args.runs_per_bench, args.strata, args.seed)
+    predicted, unknown = predict_costs(costs, selected)
+
+    with open(args.output, 'w') as file:
+        file.write("\n".join(selected) + "\n")
+    jobs = sorted((predicted[bench] for bench in selected for _ in range(args.runs_per_bench)), reverse=True)
+    print(f"Selected {len(selected)} of {len(benchs)} benchmarks ({len(unknown)} without history) "
+          f"for {cost / 3600:.2f} of {args.budget} CPU hours")
+    for name in args.families:
+        print(f"  {name}: {sum(family(bench) == name for bench in selected)} benchmarks")
+    print(f"Predicted wall time on {args.max_jobs} jobs: {predict_wall_time(jobs, args.max_jobs) / 3600:.2f} hours")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# ---------------------------------------------
+# Script: fidelity_report.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This script reports the run-to-run variance of the CPU times recorded in the results database,
+# separately for unpinned runs (one job per logical CPU, the default) and for runs pinned to their
+# own physical core (run.py's measurement-fidelity mode). For each setup it estimates how many runs
+# are needed to measure the mean time of a benchmark to a given relative precision, so that
+# `num_runs` can be set to the fewest runs that still give stable numbers.
+#
+# FUNCTIONS
+# ---------
+# - `run_variance`: Groups the successful runs by benchmark, configuration, seed, binary, campaign and setup, and
+#   computes the coefficient of variation (sample standard deviation over mean) of every group that has
+#   at least two runs. If some groups were measured in both setups, only those are kept, so the two
+#   setups are compared on the same benchmarks and configurations.
+# - `fidelity_report`: Summarizes the coefficients of variation per setup: number of groups and runs,
+#   median and 90th percentile, and `runs_needed`, the number of runs for which the standard error of
+#   the mean stays below `target_error` (relative) for 90% of the groups. Returns a pandas DataFrame.
+# - `main`: Parses the command line, prints the report and writes it to a CSV file.
+#
+# PARAMETERS
+# ----------
+# - `--results_db`: Path of the results database.
+# - `--target_error`: Target relative standard error of the mean, defaults to 0.02 (2%).
+# - `--output`: CSV file to write the report to, defaults to `fidelity_report.csv`.
+# ---------------------------------------------
+
+import math
+import argparse
+import pandas as pd
+from results_db import open_results_db
+
+GROUP_COLUMNS = ['bench', 'is_baseline', 'alpha', 'max_iter', 'prec', 'seed', 'binary_hash', 'campaign']
+
+
+def run_variance(conn):
+    runs = pd.read_sql_query(f"SELECT {', '.join(GROUP_COLUMNS)}, pinned, cpu_time FROM runs WHERE cpu_time IS NOT NULL", conn)
+    groups = runs.groupby(GROUP_COLUMNS + ['pinned'])['cpu_time'].agg(['mean', 'std', 'count']).reset_index()
+    groups = groups[(groups['count'] >= 2) & (groups['mean'] > 0)]
+    groups['cv'] = groups['std'] / groups['mean']
+
+    setups_per_group = groups.groupby(GROUP_COLUMNS)['pinned'].transform('nunique')
+    if (setups_per_group == 2).any():
+        groups = groups[setups_per_group == 2]
+    return groups
+
+
+def fidelity_report(results_db, target_error=0.02):
+    conn = open_results_db(results_db)
+    groups = run_variance(conn)
+    conn.close()
+
+    report = {'setup': [], 'groups': [], 'runs': [], 'median_cv': [], 'p90_cv': [], 'runs_needed': []}
+    for pinned, setup in [(0, 'unpinned'), (1, 'pinned')]:
+        cv = groups.loc[groups['pinned'] == pinned, 'cv']
+        if cv.empty:
+            continue
+        p90_cv = cv.quantile(0.9)
+        report['setup'].append(setup)
+        report['groups'].append(len(cv))
+        report['runs'].append(int(groups.loc[groups['pinned'] == pinned, 'count'].sum()))
+        report['median_cv'].append(cv.median())
+        report['p90_cv'].append(p90_cv)
+        report['runs_needed'].append(max(1, math.ceil((p90_cv / target_error) ** 2)))
+    return pd.DataFrame(report)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results_db', type=str, required=True)
+    parser.add_argument('--target_error', type=float, default=0.02)
+    parser.add_argument('--output', type=str, default='fidelity_report.csv')
+    args = parser.parse_args()
+
+    report = fidelity_report(args.results_db, args.target_error)
+    print(report.to_string(index=False))
+    report.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
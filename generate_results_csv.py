@@ -3,14 +3,23 @@ This function `generate_results()` generates a combined CSV file containing the
 and their respective improvements over a baseline.
 
 This script works by:
-- Reading all the CSV files in the same directory of the script.
-- Finding the baseline benchmark CSV file in the directory.
-- Extracting the parameter configurations from each CSV file name.
-- Adding a new 'parameters' column in each DataFrame to hold the extracted parameters.
-- Merging the data from all CSVs into one DataFrame.
+- Reading the recorded runs from the results database (see results_db.py), by default 'results.db' in the same
+  directory of the script, or from a Parquet export of it (a directory written by `export_parquet`), optionally
+  restricted to one campaign, to the binaries it used (or to the binaries and seeds it used, `binary_seeds`) and to
+  pinned or unpinned runs. Only the columns needed
+  below are read, and with a Parquet export only the files of the selected campaign.
+- Averaging the CPU time of each file for the baseline and for every parameter configuration, along with the
+  resource usage recorded by run.py (wall time, user+sys time, peak memory and failed runs). Runs that were killed
+  at their cutoff are censored: they count as `par_k` times their cutoff (PAR-k), so a configuration that times out
+  is penalized in the improvements and in the choice of the best parameters instead of being left out.
+- Adding a new 'parameters' column to hold the parameter configuration of each row.
 - Calculating the improvement for each file, defined as the percent change from the baseline to the test file's average time.
 - Identifying the best parameters per file, defined as the ones that yield the minimum average time.
+- Checking the best parameters of each file against the individual runs: a bootstrap confidence interval of the
+  improvement, and `p_best`, how often they remain the fastest when the runs are resampled (see run_stats.py).
 - Counting how often each parameter configuration yields the best results.
+- Comparing each parameter configuration with the baseline over all files with the shifted geometric mean of the
+  times (less sensitive to a few long benchmarks than the total time) and a paired Wilcoxon signed-rank test.
 - Calculating the average improvement for each parameter configuration and for the best configuration.
 - Writing the results to a new CSV file 'combined_results_data.csv', which contains two sections:
     1. 'Best Parameters per File': Listing each file with its best parameter configuration and corresponding statistics.
@@ -21,14 +30,20 @@ The output file 'combined_results_data.csv' will be written to the same director
 
  The dataframe best_params_per_file is added to the CSV file with the following columns:
  'file': The file name of the test case.
- 'parameters': The configuration parameters extracted from the file name.
+ 'parameters': The configuration parameters of the run.
  'avg_time_best': The average time of the best performing configuration for the test case.
  'avg_time_baseline': The average time of the baseline for the test case.
  'improvement_best': The improvement percentage of the best configuration over the baseline for the test case.
+ 'max_rss_kb_best': The peak resident memory (in KB) of the best configuration over all runs of the test case.
+ 'max_rss_kb_baseline': The peak resident memory (in KB) of the baseline over all runs of the test case.
+ 'improvement_best_ci_low', 'improvement_best_ci_high': Bootstrap confidence interval (95% by default) of improvement_best.
+ 'p_best': The fraction of bootstrap samples of the runs in which this configuration is still the fastest for the test case.
+ 'significant_best': True if the whole confidence interval of improvement_best is above 0.
 
  The dataframe merged_param_df is added to the CSV file with the following columns:
  'parameters': The configuration parameters.
  'count_best': The number of times the parameters configuration was the best.
+ 'count_significant_best': The number of times it was the best with significant_best set.
  'mean_improvement_best': The mean improvement of the best cases for this configuration.
  'std_dev_improvement_best': The standard deviation of the improvement of the best cases for this configuration.
  'min_improvement_best': The minimum improvement of the best cases for this configuration.
@@ -38,43 +53,121 @@ The output file 'combined_results_data.csv' will be written to the same director
  'min_improvement_all': The minimum improvement of all cases for this configuration.
  'max_improvement_all': The maximum improvement of all cases for this configuration.
  'total_time_improvement': The total time improvement for this configuration.
+ 'sgm_time_all', 'sgm_time_baseline': Shifted geometric mean (shift `sgm_shift`, 1 second by default) of the average
+   times of this configuration and of the baseline, over the files both have a time for.
+ 'sgm_improvement_all': The improvement of sgm_time_all over sgm_time_baseline, in %.
+ 'sgm_improvement_all_ci_low', 'sgm_improvement_all_ci_high': Bootstrap confidence interval of sgm_improvement_all,
+   resampling the files.
+ 'p_faster_all': One-sided p-value of the Wilcoxon signed-rank test, paired by file, of this configuration being
+   faster than the baseline.
+ 'mean_rss_change_all': The mean change (in %) of the peak resident memory over the baseline for this configuration.
+ 'mean_wall_to_cpu_all': The mean ratio of wall time to user+sys CPU time for this configuration. Values well above 1
+   mean the runs waited for a core, so their times are noisier.
+ 'timeouts': The number of runs of this configuration that were killed at their cutoff.
+ 'failed_runs': The number of runs of this configuration that crashed or produced no result.
 
 """
 
 import os
 import pandas as pd
-import re
 import numpy as np
-
-def generate_results(num_runs_test=10, num_runs_baseline=10, decimals=7):
+from results_db import open_results_db
+from run_stats import compare_runs, compare_configs
+
+# The only columns generate_results needs from each run
+RUN_COLUMNS = ['bench', 'is_baseline', 'alpha', 'max_iter', 'prec', 'seed', 'binary_hash', 'cpu_time', 'timed_out', 'cutoff',
+               'wall_time', 'user_time', 'sys_time', 'max_rss_kb', 'exit_code']
+
+
+def read_runs(results, filters):
+    # filters are (column, operator, value) tuples with operator '=' or 'in', as taken by read_parquet
+    if os.path.isdir(results):
+        # Parquet export (see export_parquet): only the partitions of the campaign and the needed columns are read
+        return pd.read_parquet(results, columns=RUN_COLUMNS, filters=filters or None)
+    conn = open_results_db(results)
+    conditions, params = [], []
+    for column, operator, value in filters:
+        if operator == 'in':
+            conditions.append(f"{column} IN ({', '.join('?' * len(value))})")
+            params += value
+        else:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    query = f"SELECT {', '.join(RUN_COLUMNS)} FROM runs"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    runs = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    return runs
+
+
+def load_results(results, binary_hashes=None, par_k=10, pinned=None, campaign=None, binary_seeds=None):
+    filters = []
+    if campaign is not None:
+        filters.append(('campaign', '=', campaign))
+    if binary_seeds is not None:
+        binary_hashes = {binary for binary, _ in binary_seeds}
+    if binary_hashes is not None:
+        filters.append(('binary_hash', 'in', list(binary_hashes)))
+    if pinned is not None:
+        filters.append(('pinned', '=', bool(pinned)))
+    runs = read_runs(results, filters)
+    if binary_seeds is not None:
+        # A binary can have been run under several seeds (grids changed under older versions of run.py)
+        pairs = pd.MultiIndex.from_arrays([runs['binary_hash'], runs['seed']])
+        runs = runs[pairs.isin(list(binary_seeds))].reset_index(drop=True)
+
+    # Runs killed at their cutoff count as par_k times the cutoff in avg_time (PAR-k). The other
+    # timing and usage columns only average the runs that produced a result.
+    timed_out = runs['timed_out'].fillna(0).astype(int) == 1
+    succeeded = runs['cpu_time'].notna()
+    runs['par_time'] = runs['cpu_time'].where(~timed_out, par_k * runs['cutoff'])
+    runs['result_wall_time'] = runs['wall_time'].where(succeeded)
+    runs['rusage_time'] = (runs['user_time'] + runs['sys_time']).where(succeeded)
+    runs['timeout'] = timed_out
+    runs['failed'] = ~timed_out & (~succeeded | (runs['exit_code'].fillna(0).astype(int) != 0))
+    runs['is_baseline'] = runs['is_baseline'].astype(bool)
+    configs = runs[['alpha', 'max_iter', 'prec']].drop_duplicates()
+    configs['parameters'] = [f"alpha {alpha} max iter {max_iter} prec {prec}"
+                             for alpha, max_iter, prec in zip(configs['alpha'], configs['max_iter'], configs['prec'])]
+    runs = runs.merge(configs, on=['alpha', 'max_iter', 'prec'], how='left').rename(columns={'bench': 'file'})
+    data = runs.groupby(['file', 'is_baseline', 'parameters']).agg(
+        avg_time=('par_time', 'mean'), avg_wall_time=('result_wall_time', 'mean'), avg_rusage_time=('rusage_time', 'mean'),
+        max_rss_kb=('max_rss_kb', 'max'), timeouts=('timeout', 'sum'), failed_runs=('failed', 'sum')).reset_index()
+    columns = ['file', 'parameters', 'avg_time', 'avg_wall_time', 'avg_rusage_time', 'max_rss_kb', 'timeouts', 'failed_runs']
+    baseline_data = data.loc[data['is_baseline'], columns].drop(columns='parameters')
+    all_data_df = data.loc[~data['is_baseline'], columns].reset_index(drop=True)
+    return baseline_data, all_data_df, runs[['file', 'is_baseline', 'parameters', 'par_time']].rename(columns={'par_time': 'time'})
+
+
+def generate_results(num_runs_test=10, num_runs_baseline=10, decimals=7, results_db=None, binary_hashes=None, par_k=10, pinned=None, campaign=None,
+                     n_boot=1000, confidence=0.95, sgm_shift=1.0, binary_seeds=None):
     csv_directory = os.path.dirname(os.path.abspath(__file__))
     output_file = 'combined_results_data.csv'
-    all_data = []
-
-    baseline_files = [f for f in os.listdir(csv_directory) if f.startswith("baseline_bench_data_")]
-    latest_baseline_file = max(baseline_files, key=lambda f: os.path.getmtime(os.path.join(csv_directory, f)))
-    baseline_path = os.path.join(csv_directory, latest_baseline_file)
-    baseline_data = pd.read_csv(baseline_path)
-
-    for filename in os.listdir(csv_directory):
-        if filename.endswith(".csv"):
-            match = re.search('alpha.*', filename)
-            if match is not None:
-                raw_parameters = match.group()
-            else:
-                continue
-            parameters = raw_parameters.replace('_', ' ').replace('.csv', '')
-            df = pd.read_csv(os.path.join(csv_directory, filename))
-            df['parameters'] = parameters
-            all_data.append(df)
-
-    all_data_df = pd.concat(all_data, ignore_index=True)
+    rng = np.random.default_rng(0)
+    baseline_data, all_data_df, runs = load_results(results_db or os.path.join(csv_directory, 'results.db'), binary_hashes, par_k, pinned, campaign,
+                                                    binary_seeds)
+    failed_runs_df = all_data_df.groupby('parameters')[['timeouts', 'failed_runs']].sum().reset_index()
+    # Files where every run of a configuration failed have no time to compare
+    baseline_data = baseline_data.dropna(subset=['avg_time'])
+    all_data_df = all_data_df.dropna(subset=['avg_time']).reset_index(drop=True)
+
     all_merged_df = pd.merge(all_data_df, baseline_data, on='file', suffixes=('_test', '_baseline'))
     all_merged_df['improvement'] = 100 * (all_merged_df['avg_time_baseline'] - all_merged_df['avg_time_test']) / all_merged_df['avg_time_baseline']
     best_params_per_file = all_data_df.loc[all_data_df.groupby('file')['avg_time'].idxmin()]
     merged_df = pd.merge(best_params_per_file, baseline_data, on='file', suffixes=('_best', '_baseline'))
     merged_df['improvement_best'] = 100 * (merged_df['avg_time_baseline'] - merged_df['avg_time_best']) / merged_df['avg_time_baseline']
-    best_params_per_file = merged_df[['file', 'parameters', 'avg_time_best', 'avg_time_baseline', 'improvement_best']]
+    best_params_per_file = merged_df[['file', 'parameters', 'avg_time_best', 'avg_time_baseline', 'improvement_best', 'max_rss_kb_best', 'max_rss_kb_baseline']]
+
+    # Statistics on the individual runs: how certain the improvement of the best parameters is, and how often
+    # they would still be the best if the runs were repeated (see run_stats.py)
+    run_stats_df = compare_runs(runs, n_boot, confidence, rng).rename(
+        columns={'improvement_ci_low': 'improvement_best_ci_low', 'improvement_ci_high': 'improvement_best_ci_high'})
+    best_params_per_file = best_params_per_file.merge(run_stats_df, on=['file', 'parameters'], how='left')
+    best_params_per_file['significant_best'] = best_params_per_file['improvement_best_ci_low'] > 0
+    significant_df = best_params_per_file.groupby('parameters')['significant_best'].sum().reset_index()
+    significant_df.columns = ['parameters', 'count_significant_best']
+    config_stats_df = compare_configs(all_data_df, baseline_data, n_boot, confidence, sgm_shift, rng)
 
     # New metrics
     all_merged_df['total_time_test'] = all_merged_df['avg_time_test'] * num_runs_test
@@ -84,6 +177,13 @@ def generate_results(num_runs_test=10, num_runs_baseline=10, decimals=7):
     total_time_df = total_time_per_param.reset_index()
     total_time_df.columns = ['parameters', 'total_time_improvement']
 
+    # Resource usage: peak memory relative to the baseline, and wall time over the CPU time the OS charged to the
+    # process, which grows when jobs wait for a core
+    all_merged_df['rss_change'] = 100 * (all_merged_df['max_rss_kb_test'] - all_merged_df['max_rss_kb_baseline']) / all_merged_df['max_rss_kb_baseline']
+    all_merged_df['wall_to_cpu'] = all_merged_df['avg_wall_time_test'] / all_merged_df['avg_rusage_time_test']
+    usage_df = all_merged_df.groupby('parameters')[['rss_change', 'wall_to_cpu']].mean().reset_index()
+    usage_df.columns = ['parameters', 'mean_rss_change_all', 'mean_wall_to_cpu_all']
+
     param_counts = best_params_per_file['parameters'].value_counts()
     param_counts_df = param_counts.reset_index()
     param_counts_df.columns = ['parameters', 'count_best']
@@ -95,10 +195,18 @@ def generate_results(num_runs_test=10, num_runs_baseline=10, decimals=7):
     best_param_improvements.columns = ['mean_improvement_best', 'std_dev_improvement_best', 'min_improvement_best', 'max_improvement_best']
 
     # Combine dataframes
-    merged_param_df = pd.merge(best_param_improvements, all_param_improvements, left_index=True, right_index=True)
-    merged_param_df = merged_param_df.merge(param_counts_df, left_index=True, right_on='parameters')
+    # Every configuration is listed, including those that were never the best (count_best 0) or whose runs all failed
+    merged_param_df = pd.merge(best_param_improvements, all_param_improvements, left_index=True, right_index=True, how='right')
+    merged_param_df = merged_param_df.rename_axis('parameters').reset_index()
+    merged_param_df = merged_param_df.merge(param_counts_df, on='parameters', how='left')
     merged_param_df = merged_param_df.merge(total_time_df, on='parameters')
-    merged_param_df = merged_param_df[['parameters', 'count_best', 'mean_improvement_best', 'std_dev_improvement_best', 'min_improvement_best', 'max_improvement_best', 'mean_improvement_all', 'std_dev_improvement_all', 'min_improvement_all', 'max_improvement_all', 'total_time_improvement']]
+    merged_param_df = merged_param_df.merge(usage_df, on='parameters').merge(failed_runs_df, on='parameters', how='right')
+    merged_param_df = merged_param_df.merge(significant_df, on='parameters', how='left').merge(config_stats_df, on='parameters', how='left')
+    merged_param_df['count_best'] = merged_param_df['count_best'].fillna(0).astype(int)
+    merged_param_df['count_significant_best'] = merged_param_df['count_significant_best'].fillna(0).astype(int)
+    merged_param_df = merged_param_df[['parameters', 'count_best', 'count_significant_best', 'mean_improvement_best', 'std_dev_improvement_best', 'min_improvement_best', 'max_improvement_best', 'mean_improvement_all', 'std_dev_improvement_all', 'min_improvement_all', 'max_improvement_all', 'total_time_improvement',
+                                       'sgm_time_all', 'sgm_time_baseline', 'sgm_improvement_all', 'sgm_improvement_all_ci_low', 'sgm_improvement_all_ci_high', 'p_faster_all',
+                                       'mean_rss_change_all', 'mean_wall_to_cpu_all', 'timeouts', 'failed_runs']]
     merged_param_df = merged_param_df.sort_values(by='count_best', ascending=False)
 
     # After calculations, before writing to CSV
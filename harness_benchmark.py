@@ -0,0 +1,273 @@
+# ---------------------------------------------
+# Script: harness_benchmark.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This script measures how much time the tools themselves cost, independently of Ibex, so that a
+# change to run.py, parse_results.py or generate_results_csv.py that slows them down at scale is
+# noticed. It replaces `ibexopt` by a stand-in shell script that sleeps and/or burns CPU for a given
+# time and prints the same summary lines as `ibexopt` ("cpu time used", "number of cells", ...), and
+# runs complete campaigns against it in a temporary directory.
+#
+# For every job count given with `--scales` it reports:
+# - `scheduler`: run.py's throughput in jobs per second, the utilization of the job slots (time spent in
+#   jobs over wall time times slots) and the CPU time run.py itself used per job. With the default
+#   `--sleep 0` the stand-in returns at once, so this is the overhead of spawning, parsing and recording.
+# - `parser`: the throughput of `extract_data` over that many output files, in files and MB per second.
+# - `generate_results`: the time `generate_results` takes on a results database with that many runs.
+#
+# With `--baseline`, the results are compared with an earlier `--output` file, and the script exits
+# with status 1 if a metric got worse by more than `--tolerance`.
+#
+# FUNCTIONS
+# ---------
+# - `fake_output`: Returns the text the stand-in prints: `--output_lines` lines of progress, then the summary.
+# - `write_fake_ibexopt`: Writes the stand-in `ibexopt` shell script.
+# - `calibrate_burn`: Measures how many iterations of the stand-in's busy loop take one second.
+# - `make_ibex_tree`: Creates a minimal Ibex tree (benchmarks, header, `waf` and the stand-in) and bench list.
+# - `bench_scheduler`: Runs a campaign of the given size with run.py and measures it.
+# - `bench_parser`: Writes output files and measures `extract_data` on them.
+# - `bench_generate_results`: Fills a results database with random runs and times `generate_results`.
+# - `regressions`: Lists the metrics that got worse than in a baseline file.
+# - `main`: Parses the command line, runs the benchmarks and prints (and optionally saves) the results.
+#
+# PARAMETERS
+# ----------
+# - `--scales`: Job counts to measure, defaults to 1000 10000 100000.
+# - `--benchmarks`: Benchmarks to run, any of `scheduler`, `parser` and `generate_results`; defaults to all three.
+# - `--max_jobs`: Number of parallel jobs of the scheduler benchmark, defaults to the number of CPUs.
+# - `--sleep`, `--burn`: Seconds each stand-in job sleeps and burns CPU, both default to 0.
+# - `--output_lines`: Lines of progress the stand-in prints before its summary, defaults to 50.
+# - `--output`: CSV file to save the results to.
+# - `--baseline`, `--tolerance`: CSV file of an earlier run to compare with, and the relative slowdown
+#   (default 0.2, i.e. 20%) above which a metric counts as a regression.
+# ---------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import resource
+import contextlib
+import subprocess
+import pandas as pd
+from multiprocessing import cpu_count
+import run
+from parse_results import extract_data
+from generate_results_csv import generate_results
+from results_db import open_results_db, RUN_KEY
+
+# Configurations of the scheduler benchmark: the baseline plus these, one run each
+ALPHA_VALUES = [0.8, 0.75, 0.85, 0.7]
+
+# Metrics where a higher value is better; for the others (times) lower is better
+HIGHER_IS_BETTER = {'jobs_per_s', 'utilization', 'files_per_s', 'mb_per_s'}
+
+
+def fake_output(output_lines, cpu_time):
+    progress = "".join(f" {i}\t[-1.500000000001, 2.499999999999]\t{i * 17} cells\n" for i in range(output_lines))
+    return (progress +
+            "\n optimization successful!\n\n"
+            " f* in\t[-1.00000000001,-0.999999999999]\n\t(best bound)\n\n"
+            " x* =\t(0.5 ; 0.5)\n\t(best feasible point)\n\n"
+            " relative precision on f*:\t9.99999e-13 [passed]\n"
+            " absolute precision on f*:\t9.99999e-13 [passed]\n"
+            f" cpu time used:\t\t\t{cpu_time:.4f}s\n"
+            " number of cells:\t\t1234\n")
+
+
+def write_fake_ibexopt(path, sleep, burn_iterations, output_lines):
+    # A shell script rather than Python, so that its own start-up does not hide the harness overhead
+    script = ["#!/bin/sh", "# Stand-in for ibexopt written by harness_benchmark.py"]
+    if sleep > 0:
+        script.append(f"sleep {sleep}")
+    if burn_iterations > 0:
+        script.append(f"i=0; while [ $i -lt {burn_iterations} ]; do i=$((i+1)); done")
+    script.append(f"printf '%s' '{fake_output(output_lines, sleep)}'")
+    with open(path, "w") as file:
+        file.write("\n".join(script) + "\n")
+    os.chmod(path, 0o755)
+
+
+def calibrate_burn(directory):
+    iterations = 200000
+    write_fake_ibexopt(os.path.join(directory, "calibrate"), 0, iterations, 0)
+    start = time.monotonic()
+    subprocess.run([os.path.join(directory, "calibrate")], stdout=subprocess.DEVNULL, check=True)
+    return int(iterations / (time.monotonic() - start))
+
+
+def make_ibex_tree(root, num_benchs, sleep, burn_iterations, output_lines):
+    ibex_dir = os.path.join(root, "ibex")
+    os.makedirs(os.path.join(ibex_dir, "benchs", "optim", "bench"))
+    os.makedirs(os.path.join(ibex_dir, "__build__", "src"))
+    os.makedirs(os.path.join(ibex_dir, "src", "loup"))
+    os.makedirs(os.path.join(root, "tools", "outputs"))
+    benchs = [f"bench/b{i:06d}" for i in range(num_benchs)]
+    for bench in benchs:
+        open(os.path.join(ibex_dir, "benchs", "optim", f"{bench}.bch"), "w").close()
+    with open(os.path.join(root, "tools", "bench_list"), "w") as file:
+        file.write("\n".join(benchs) + "\n")
+    with open(os.path.join(ibex_dir, "src", "loup", "ibex_LoupFinderIterative.h"), "w") as file:
+        file.write("double alpha=;\nint max_iter=;\ndouble prec=;\n")
+    with open(os.path.join(ibex_dir, "waf"), "w") as file:
+        file.write("#!/bin/sh\nexit 0\n")
+    os.chmod(os.path.join(ibex_dir, "waf"), 0o755)
+    write_fake_ibexopt(os.path.join(ibex_dir, "__build__", "src", "ibexopt"), sleep, burn_iterations, output_lines)
+    return ibex_dir
+
+
+def bench_scheduler(num_jobs, max_jobs, sleep, burn_iterations, output_lines):
+    root = tempfile.mkdtemp(prefix="harness_benchmark_")
+    num_benchs = max(1, num_jobs // (len(ALPHA_VALUES) + 1))
+    ibex_dir = make_ibex_tree(root, num_benchs, sleep, burn_iterations, output_lines)
+    tools_dir = os.path.join(root, "tools")
+    settings = dict(ibex_dir=ibex_dir, tools_dir=tools_dir, input_file=os.path.join(tools_dir, "bench_list"),
+                    ibexopt=os.path.join(ibex_dir, "__build__", "src", "ibexopt"),
+                    header_file=os.path.join(ibex_dir, "src", "loup", "ibex_LoupFinderIterative.h"),
+                    build_cache_dir=os.path.join(tools_dir, "build_cache"), results_db=os.path.join(tools_dir, "results.db"),
+                    metrics_file=os.path.join(tools_dir, "metrics.json"),
+                    alpha_values=ALPHA_VALUES, max_iter_values=[4], prec_values=[1e-4], num_combinations=len(ALPHA_VALUES),
+                    num_runs=1, baseline_num_runs=1, max_jobs=max_jobs, generate_results=lambda *args, **kwargs: None,
+                    # Every mode is set explicitly, so the measurement does not depend on how run.py is configured
+                    campaign="harness_benchmark", distributed=False, cpu_budget_hours=None, pin_jobs=False, racing=False,
+                    search_mode=False, job_timeout=None, adaptive_cutoff=None, archive_outputs=True,
+                    status_interval=None, metrics_port=None)
+    saved = {name: getattr(run, name) for name in settings}
+    for name, value in settings.items():
+        setattr(run, name, value)
+    try:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.monotonic()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            run.main()
+        elapsed = time.monotonic() - start
+        harness_usage = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        for name, value in saved.items():
+            setattr(run, name, value)
+
+    conn = open_results_db(settings["results_db"])
+    jobs, job_time = conn.execute("SELECT COUNT(*), SUM(wall_time) FROM runs").fetchone()
+    conn.close()
+    shutil.rmtree(root)
+    harness_cpu = (harness_usage.ru_utime - usage.ru_utime) + (harness_usage.ru_stime - usage.ru_stime)
+    return {'jobs_per_s': jobs / elapsed, 'utilization': job_time / (elapsed * max_jobs),
+            'harness_cpu_ms_per_job': 1000 * harness_cpu / jobs, 'seconds': elapsed}
+
+
+def bench_parser(num_files, output_lines):
+    root = tempfile.mkdtemp(prefix="harness_benchmark_")
+    files = [os.path.join(root, f"output-{i}.txt") for i in range(num_files)]
+    for path in files:
+        with open(path, "w") as file:
+            file.write(fake_output(output_lines, random.random()))
+    size = sum(os.path.getsize(path) for path in files)
+    start = time.monotonic()
+    for path in files:
+        extract_data(path)
+    elapsed = time.monotonic() - start
+    shutil.rmtree(root)
+    return {'files_per_s': num_files / elapsed, 'mb_per_s': size / 1e6 / elapsed, 'seconds': elapsed}
+
+
+def bench_generate_results(num_runs):
+    root = tempfile.mkdtemp(prefix="harness_benchmark_")
+    results_db = os.path.join(root, "results.db")
+    # 36 configurations and a baseline, 3 runs each, as many benchmarks as needed to reach num_runs
+    configs = [(False, alpha, max_iter, prec, seed) for seed, (alpha, max_iter, prec) in enumerate(
+        [(alpha, max_iter, prec) for alpha in [0.8, 0.75, 0.85] for max_iter in [4, 6, 8, 10] for prec in [1e-4, 5e-5, 2e-4]], start=1)]
+    configs.append((True, 0.9, 10, 1e-3, 1))
+    num_benchs = max(1, num_runs // (3 * len(configs)))
+    rows = []
+    for bench in range(num_benchs):
+        bench_time = random.lognormvariate(0, 2)
+        for is_baseline, alpha, max_iter, prec, seed in configs:
+            for run_number in range(1, 4):
+                cpu_time = bench_time * random.lognormvariate(0, 0.1)
+                rows.append((f"bench/b{bench:06d}", int(is_baseline), alpha, max_iter, prec, run_number, seed, "0" * 16, 0,
+                             "default", cpu_time, 1234, cpu_time * 1.05, cpu_time * 0.95, cpu_time * 0.05, 100000, 0, 0))
+    columns = RUN_KEY + ['cpu_time', 'num_cells', 'wall_time', 'user_time', 'sys_time', 'max_rss_kb', 'exit_code', 'timed_out']
+    conn = open_results_db(results_db)
+    conn.executemany(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+    conn.commit()
+    conn.close()
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        start = time.monotonic()
+        generate_results(3, 3, results_db=results_db)
+        elapsed = time.monotonic() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+    return {'seconds': elapsed}
+
+
+def regressions(results, baseline, tolerance):
+    merged = results.merge(baseline, on=['benchmark', 'scale', 'metric'], suffixes=('', '_baseline'))
+    worse = []
+    for _, row in merged.iterrows():
+        higher_is_better = row['metric'] in HIGHER_IS_BETTER
+        ratio = row['value_baseline'] / row['value'] if higher_is_better else row['value'] / row['value_baseline']
+        if ratio > 1 + tolerance:
+            worse.append(f"{row['benchmark']} {row['metric']} at {row['scale']} jobs: {row['value']:.4g} "
+                         f"(was {row['value_baseline']:.4g})")
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--benchmarks', nargs='+', choices=['scheduler', 'parser', 'generate_results'],
+                        default=['scheduler', 'parser', 'generate_results'])
+    parser.add_argument('--max_jobs', type=int, default=cpu_count())
+    parser.add_argument('--sleep', type=float, default=0.0)
+    parser.add_argument('--burn', type=float, default=0.0)
+    parser.add_argument('--output_lines', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--baseline', type=str, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(0)
+    burn_iterations = 0
+    if args.burn > 0:
+        calibration_dir = tempfile.mkdtemp(prefix="harness_benchmark_")
+        burn_iterations = int(args.burn * calibrate_burn(calibration_dir))
+        shutil.rmtree(calibration_dir)
+
+    results = {'benchmark': [], 'scale': [], 'metric': [], 'value': []}
+    for scale in args.scales:
+        for benchmark in args.benchmarks:
+            if benchmark == 'scheduler':
+                metrics = bench_scheduler(scale, args.max_jobs, args.sleep, burn_iterations, args.output_lines)
+            elif benchmark == 'parser':
+                metrics = bench_parser(scale, args.output_lines)
+            else:
+                metrics = bench_generate_results(scale)
+            for metric, value in metrics.items():
+                results['benchmark'].append(benchmark)
+                results['scale'].append(scale)
+                results['metric'].append(metric)
+                results['value'].append(value)
+            print(f"{benchmark} at {scale} jobs: " + ", ".join(f"{metric} {value:.4g}" for metric, value in metrics.items()))
+    results = pd.DataFrame(results)
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+    if args.baseline:
+        worse = regressions(results, pd.read_csv(args.baseline), args.tolerance)
+        for line in worse:
+            print(f"Regression: {line}")
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
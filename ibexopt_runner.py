@@ -0,0 +1,186 @@
+# ---------------------------------------------
+# Script: ibexopt_runner.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module runs a single `ibexopt` process and parses its output. It is shared by run.py, which
+# runs the jobs of a local campaign, and by worker.py, which runs the jobs of a distributed one, and
+# only depends on the standard library (plus `output_archive.py` and the pinning state), so a worker
+# does not need the analysis dependencies of run.py.
+#
+# FUNCTIONS
+# ---------
+# - `parse_output`: Takes the lines of an `ibexopt` output, as a file or as a stream while the process is still
+#   running, and matches them one by one. It keeps only the summary fields: the status line, the f* enclosure,
+#   the relative and absolute precision, the CPU time and the number of cells. Fields that are not found are
+#   returned as None.
+# - `output_name`: Returns the name of a run's output file, which is also its key in the archive.
+# - `run_ibexopt`: Runs one `ibexopt` command, writes its output to a text file or an archive (see
+#   `output_archive.py`) while parsing it, kills it at its cutoff, and returns the summary fields together
+#   with its resource usage and wall time. In measurement-fidelity mode it takes a free core from the pinning
+#   state, starts `ibexopt` pinned to it with `sched_setaffinity`, and gives the core back when the process exits.
+# - `kill_group`: Kills the process group of a run that reached its cutoff and marks it as timed out.
+# - `wait_for_usage`: Reaps an `ibexopt` process with `wait4` and returns its exit code (negative for a signal), the
+#   terminating signal, user and sys CPU time, peak RSS, page faults and context switches.
+# - `kill_running`: Kills every `ibexopt` process that is still running, when a campaign is stopped.
+# - `copy_lines`: Copies each output line to the output file while passing it on to the parser.
+# ---------------------------------------------
+
+import os
+import re
+import time
+import signal
+import threading
+import subprocess
+from output_archive import open_output
+
+running_processes = set()  # ibexopt processes that have not been reaped yet
+running_lock = threading.Lock()
+stopping = threading.Event()  # set by kill_running, processes started afterwards are killed right away
+
+SUMMARY_PATTERNS = {
+    'status': re.compile(r'^\s*(optimization successful|infeasible problem|no feasible point found|unbounded objective|time limit [-\d\.e]+s? reached)'),
+    'f_star': re.compile(r'f\* in\s+\[\s*([^,\]]+),\s*([^\]]+)\]'),
+    'relative_prec': re.compile(r'relative precision on f\*:\s+([-\d\.e+]+)'),
+    'absolute_prec': re.compile(r'absolute precision on f\*:\s+([-\d\.e+]+)'),
+    'cpu_time': re.compile(r'cpu time used:\s+([-\d\.e]+)s'),
+    'num_cells': re.compile(r'number of cells:\s+([-\d\.e]+)'),
+}
+
+
+def parse_float(value):
+    # ibexopt prints unbounded values as (-)oo
+    value = value.strip().replace('oo', 'inf')
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_output(lines):
+    summary = {'status': None, 'f_lower': None, 'f_upper': None, 'relative_prec': None, 'absolute_prec': None,
+               'cpu_time': None, 'num_cells': None}
+    for line in lines:
+        for field, pattern in SUMMARY_PATTERNS.items():
+            match = pattern.search(line)
+            if match is None:
+                continue
+            if field == 'status':
+                summary['status'] = match.group(1)
+            elif field == 'f_star':
+                summary['f_lower'] = parse_float(match.group(1))
+                summary['f_upper'] = parse_float(match.group(2))
+            elif field == 'cpu_time':
+                summary['cpu_time'] = round(float(match.group(1)), 7)
+            elif field == 'num_cells':
+                summary['num_cells'] = int(float(match.group(1)))
+            else:
+                summary[field] = parse_float(match.group(1))
+            break
+    return summary
+
+
+def output_name(file_path, run, is_baseline, alpha, max_iter, prec):
+    file_name = os.path.basename(file_path)
+    output_prefix = "baseline_" if is_baseline else ""
+    alpha_str = str(alpha).replace(".", ",")
+    max_iter_str = str(max_iter)
+    prec_str = str(prec).replace(".", ",")
+    output_params = f"_alpha{alpha_str}_maxIter{max_iter_str}_prec{prec_str}"
+    return f"{output_prefix}{file_name+output_params}-{run}.txt"
+
+
+def run_ibexopt(cmd, output_file, cutoff, pinning=None):
+    timed_out = threading.Event()
+    timer = None
+    slot = None
+    if pinning is not None:
+        # The affinity of this worker thread is inherited by the child, so ibexopt starts on its own core.
+        # The thread itself goes back to the harness CPUs right after the fork.
+        free_slots, harness = pinning
+        slot = free_slots.get()
+    try:
+        if slot is not None:
+            os.sched_setaffinity(0, slot)
+        start_time = time.monotonic()
+        with open_output(output_file) as out:
+            try:
+                # ibexopt gets its own process group, so a timeout kills everything it started
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, start_new_session=True)
+            finally:
+                if slot is not None:
+                    os.sched_setaffinity(0, harness)
+            with running_lock:
+                running_processes.add(process)
+                if stopping.is_set():
+                    kill_group(process, timed_out)
+            if cutoff is not None:
+                timer = threading.Timer(cutoff, kill_group, (process, timed_out))
+                timer.start()
+            # The child is reaped with wait4 rather than Popen.wait, so the pipe has to be closed here
+            with process.stdout:
+                summary = parse_output(copy_lines(process.stdout, out))
+            usage = wait_for_usage(process, timer)
+        usage["wall_time"] = round(time.monotonic() - start_time, 7)
+    finally:
+        # Given back even if ibexopt could not be started, or a worker would lose a core with every failed job
+        if slot is not None:
+            free_slots.put(slot)
+    if slot is not None:
+        usage["cpus"] = ",".join(map(str, sorted(slot)))
+    if timed_out.is_set():
+        print(f"Timed out after {cutoff:.1f}s: {output_file}")
+    elif summary["cpu_time"] is None or summary["num_cells"] is None:
+        print(f"Missing data in {output_file} (exit code {usage['exit_code']})")
+    return dict(summary, **usage, timed_out=int(timed_out.is_set()), cutoff=cutoff, output_file=output_file)
+
+
+def kill_group(process, timed_out):
+    timed_out.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def wait_for_usage(process, timer=None):
+    # Wait for the exit without reaping first, so a pending timeout can never signal a reused pid
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    if timer is not None:
+        timer.cancel()
+        timer.join()
+    # Reap the child ourselves to get its own rusage; Popen.wait() would discard it
+    with running_lock:
+        running_processes.discard(process)
+        _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "exit_code": process.returncode,
+        "term_signal": os.WTERMSIG(status) if os.WIFSIGNALED(status) else None,
+        "user_time": round(rusage.ru_utime, 7),
+        "sys_time": round(rusage.ru_stime, 7),
+        "max_rss_kb": rusage.ru_maxrss,
+        "minor_faults": rusage.ru_minflt,
+        "major_faults": rusage.ru_majflt,
+        "voluntary_switches": rusage.ru_nvcsw,
+        "involuntary_switches": rusage.ru_nivcsw,
+    }
+
+
+def kill_running():
+    # ibexopt runs in its own session, so Ctrl-C does not reach it
+    with running_lock:
+        stopping.set()
+        for process in running_processes:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+def copy_lines(lines, out):
+    # Writes the raw output to its file while the parser consumes it line by line
+    for line in lines:
+        out.write(line)
+        yield line
@@ -0,0 +1,146 @@
+# ---------------------------------------------
+# Script: output_archive.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module stores the raw `ibexopt` outputs of a campaign in a single compressed archive instead
+# of one text file per run, which saves inodes and keeps the `outputs` directory small. The archive
+# `{campaign}.gz` is a sequence of gzip members, one per run, appended as the runs finish; as a whole
+# it is a valid gzip file, so `zcat` prints every output of the campaign. Next to it, the index
+# `{campaign}.gz.index` has one line per run with its key, offset and compressed length, so a single
+# output is read by seeking to it and decompressing only its member.
+#
+# A run's output is compressed while it streams and appended once the process exits, under an
+# exclusive `flock` on the archive, so several threads or processes can write to the same archive.
+# The archive and the index are append-only: a run that is executed again gets a new record, and
+# the latest record of a key is the one that is read. A record whose index line was never written
+# (the harness was killed in between) is simply unreachable.
+#
+# Outputs are referred to as `{archive}#{key}`, where the key is the benchmark's directory followed by
+# the name run.py gives the output file (see `output_name`). This reference is what run.py records
+# in the `output_file` column of the results database; plain paths still refer to text files.
+#
+# FUNCTIONS
+# ---------
+# - `archive_path`: Returns the path of a campaign's archive in an outputs directory.
+# - `output_reference`: Returns the reference of a run's output in an archive.
+# - `open_output`: Opens an output for writing: the text file for a plain path, or an `ArchiveRecord` that
+#   compresses what is written to it and appends it to the archive when it is closed.
+# - `read_index`: Returns the index of an archive as a dict from key to (offset, length). The index is cached
+#   and only the lines appended since the last call are read.
+# - `read_output`: Returns the text of an output, from its text file or from its archive.
+# - `main`: Lists the keys of an archive, or prints the output of one run.
+#
+# PARAMETERS
+# ----------
+# - `archive`: Path of the archive.
+# - `key`: Key of the run to print; without it, the keys of all runs are listed.
+# ---------------------------------------------
+
+import os
+import sys
+import zlib
+import fcntl
+import argparse
+import threading
+
+# Records are gzip members (zlib with a gzip header), so the archive can be read with standard tools
+GZIP_WBITS = 31
+
+index_cache = {}  # archive path -> (bytes of the index already read, {key: (offset, length)})
+index_lock = threading.Lock()
+
+
+def archive_path(outputs_dir, campaign):
+    return os.path.join(outputs_dir, f"{campaign}.gz")
+
+
+def output_reference(archive, file_path, name):
+    return f"{archive}#{os.path.join(os.path.dirname(file_path), name)}"
+
+
+class ArchiveRecord:
+    def __init__(self, archive, key):
+        self.archive = archive
+        self.key = key
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        self.chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        self.chunks.append(self.compressor.compress(text.encode()))
+
+    def close(self):
+        self.chunks.append(self.compressor.flush())
+        record = b"".join(self.chunks)
+        with open(self.archive, "ab") as archive, open(self.archive + ".index", "a") as index:
+            fcntl.flock(archive, fcntl.LOCK_EX)
+            try:
+                offset = archive.seek(0, os.SEEK_END)
+                archive.write(record)
+                archive.flush()
+                # The index line is only written once the record is complete
+                index.write(f"{self.key}\t{offset}\t{len(record)}\n")
+                index.flush()
+            finally:
+                fcntl.flock(archive, fcntl.LOCK_UN)
+
+
+def open_output(output_file):
+    if "#" not in output_file:
+        return open(output_file, "w")
+    archive, key = output_file.split("#", 1)
+    return ArchiveRecord(archive, key)
+
+
+def read_index(archive):
+    with index_lock:
+        position, index = index_cache.get(archive, (0, {}))
+        with open(archive + ".index", "rb") as file:
+            file.seek(position)
+            for line in file:
+                # A line being written by another process is read on the next call
+                if not line.endswith(b"\n"):
+                    break
+                key, offset, length = line.decode().rstrip("\n").split("\t")
+                index[key] = (int(offset), int(length))
+                position += len(line)
+        index_cache[archive] = (position, index)
+        return index
+
+
+def read_output(output_file):
+    if "#" not in output_file:
+        with open(output_file, "r") as file:
+            return file.read()
+    archive, key = output_file.split("#", 1)
+    index = read_index(archive)
+    if key not in index:
+        raise KeyError(f"No output {key!r} in {archive}")
+    offset, length = index[key]
+    with open(archive, "rb") as file:
+        file.seek(offset)
+        return zlib.decompress(file.read(length), GZIP_WBITS).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archive', type=str)
+    parser.add_argument('key', type=str, nargs='?', default=None)
+    args = parser.parse_args()
+
+    if args.key is None:
+        for key in sorted(read_index(args.archive)):
+            print(key)
+    else:
+        sys.stdout.write(read_output(f"{args.archive}#{args.key}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,24 +5,37 @@
 # OVERVIEW
 # --------
 # This script parses and analyses the output of optimization tasks performed 
-# by the 'ibexopt' tool. The output from each task is stored in a text file,
-# from which this script extracts, processes and structures the data for further
-# analysis. The script takes in a list of files to process and some relevant parameters
-# and produces summarized results.
+# by the 'ibexopt' tool. run.py parses the output of each task while it runs
+# (see `parse_output` in ibexopt_runner.py) and records the summary in the results database (see
+# results_db.py), from which this script processes and structures the data for
+# further analysis. The script
+# takes in a list of files to process and some relevant parameters and produces
+# summarized results.
 #
 # FUNCTIONS
 # ---------
-# - `extract_data`: This function takes as input the name of an output file, reads the file,
-#   extracts the CPU time and number of cells, and returns them. If either value is not found,
+# - `extract_data`: This function takes as input the name of an output file, or the reference of an
+#   output in a campaign archive (see output_archive.py, only that run's record is decompressed),
+#   parses it, and returns the CPU time and number of cells. If either value is not found,
 #   the function prints a warning message and returns None for both values.
 #
-# - `process_files`: This function takes as input a list of file names, a directory path, and
-#   values for alpha, max_iter and prec. It then processes each file, collects statistics such
-#   as the average, standard deviation, median, minimum and maximum of both the CPU times and 
-#   the number of cells across the tasks. It returns a pandas DataFrame summarizing the results.
+# - `process_files`: This function takes as input a list of file names, a results database connection,
+#   values for alpha, max_iter and prec, the campaign, whether the runs were pinned and optionally the hash of
+#   the binary that made them. It then looks up the recorded runs of each file,
+#   collects statistics such as the average, standard deviation, median, minimum and maximum of both the CPU times and 
+#   the number of cells across the tasks. It also summarizes the resource usage recorded by run.py:
+#   the number of runs killed at their cutoff (which are not part of the time statistics), the
+#   number of failed runs, the average wall, user and sys time, the peak RSS over all runs, and
+#   the average number of major page faults and involuntary context switches. It returns a pandas
+#   DataFrame summarizing the results.
+#
+# - `column_mean`: Averages one column over a list of recorded runs, skipping missing values.
+#
+# - `process_latest`: Calls `process_files` on the runs of the binary a configuration was last run with in the
+#   campaign, so that runs made before a change of the Ibex sources are not averaged with the current ones.
 #
 # - `main`: This function is the main entry point of the script. It parses command line arguments
-#   for the various parameters and file paths, then calls `process_files` to process the files 
+#   for the various parameters and file paths, then calls `process_latest` to process the files 
 #   and summarize the results. Finally, it writes the results to a CSV file.
 #
 # PARAMETERS
@@ -34,67 +47,59 @@
 # - `--ibex_tools_dir`: Directory where ibex tools are located.
 # - `--bench_list`: A text file containing a list of benchmarks to run.
 # - `--baseline_params`: A string containing the parameters used in the baseline run, separated by spaces.
+# - `--results_db`: Path of the results database, defaults to `results.db` in the ibex tools directory.
+# - `--campaign`: Campaign whose runs are processed, defaults to `default`.
+# - `--pinned`: Process the runs made with `pin_jobs` instead of the unpinned ones.
+# - `--parquet`: Directory to also export the campaign's runs to, as a Parquet dataset partitioned by campaign
+#   that `generate_results` can read instead of the database.
 #
 # EXECUTION
 # ---------
-# The script extracts CPU times and number of cells from each output file whose name matches
-# a pattern generated from the input parameters. It calculates several statistical measures from
+# The script reads the CPU times and number of cells recorded for each benchmark and
+# parameter combination from the results database. It calculates several statistical measures from
 # the extracted values and stores them in a pandas DataFrame. The DataFrame is then written to a 
 # CSV file. The filename of the CSV file includes a timestamp and the input parameters.
 # ---------------------------------------------
 
 import pandas as pd
-import re
 import numpy as np
-import glob
-import os
 from datetime import datetime
 import argparse
 import itertools
+from results_db import open_results_db, run_results, latest_binary, export_parquet, DEFAULT_CAMPAIGN
+from output_archive import read_output
+from ibexopt_runner import parse_output
 
 
 def extract_data(output_file):
-    with open(output_file, 'r') as f:
-        file_contents = f.read()
-
-    cpu_time_match = re.search(r'cpu time used:\s+([-\d\.e]+)s', file_contents)
-    num_cells_match = re.search(r'number of cells:\s+([-\d\.e]+)', file_contents)
-    if cpu_time_match and num_cells_match:
-        cpu_time = round(float(cpu_time_match.group(1)), 7)
-        num_cells = int(float(num_cells_match.group(1)))
-        return cpu_time, num_cells
+    summary = parse_output(read_output(output_file).splitlines(keepends=True))
+
+    if summary['cpu_time'] is not None and summary['num_cells'] is not None:
+        return summary['cpu_time'], summary['num_cells']
     else:
         print(f"Skipping file: {output_file} due to missing data")
-        print("File contents:")
-        print(file_contents)
         return None, None
 
 
-def process_files(file_names, ibex_tools_dir, alpha, max_iter, prec, is_baseline=False):
-    results = {'file': [], 'params': [], 'avg_time': [], 'std_time': [], 'avg_cells': [], 'std_cells': [], 'median_time': [], 'median_cells': [], 'min_time': [], 'max_time': [], 'min_cells': [], 'max_cells': []}
+def column_mean(rows, column):
+    # Runs recorded before resource usage was collected have no value for these columns
+    values = [row[column] for row in rows if row[column] is not None]
+    return np.mean(values) if values else np.nan
+
+
+def process_files(file_names, conn, alpha, max_iter, prec, is_baseline=False, campaign=DEFAULT_CAMPAIGN, pinned=False, binary_hash=None):
+    results = {'file': [], 'params': [], 'avg_time': [], 'std_time': [], 'avg_cells': [], 'std_cells': [], 'median_time': [], 'median_cells': [], 'min_time': [], 'max_time': [], 'min_cells': [], 'max_cells': [],
+               'timeouts': [], 'failed_runs': [], 'avg_wall_time': [], 'avg_user_time': [], 'avg_sys_time': [], 'max_rss_kb': [], 'avg_major_faults': [], 'avg_involuntary_switches': []}
     alpha_str = str(alpha).replace('.', ',')
     max_iter_str = str(max_iter)
     prec_str = str(prec).replace('.', ',')
+    param_pattern = f"_alpha{alpha_str}_maxIter{max_iter_str}_prec{prec_str}"
 
     for file_name in file_names:
-        if is_baseline:
-            param_pattern = f"_alpha{alpha_str}_maxIter{max_iter_str}_prec{prec_str}"
-            output_file_pattern = 'baseline_' + os.path.basename(file_name) + param_pattern
-            output_files = sorted(glob.glob(f"{ibex_tools_dir}/outputs/{output_file_pattern}-*.txt"),
-                                  key=lambda x: int(x.rsplit('-', 1)[1].split('.')[0]))
-        else:
-            param_pattern = f"_alpha{alpha_str}_maxIter{max_iter_str}_prec{prec_str}"
-            output_file_pattern = os.path.basename(file_name) + param_pattern
-            output_files = sorted(glob.glob(f"{ibex_tools_dir}/outputs/{output_file_pattern}-*.txt"),
-                                  key=lambda x: int(x.rsplit('-', 1)[1].split('.')[0]))
-        
-        times = []
-        cells = []
-        for output_file in output_files:
-            cpu_time, num_cells = extract_data(output_file)
-            if cpu_time is not None and num_cells is not None:
-                times.append(cpu_time)
-                cells.append(num_cells)
+        rows = run_results(conn, file_name, is_baseline, alpha, max_iter, prec, campaign, pinned, binary_hash)
+        succeeded = [row for row in rows if row['cpu_time'] is not None and row['num_cells'] is not None]
+        times = [row['cpu_time'] for row in succeeded]
+        cells = [row['num_cells'] for row in succeeded]
 
         if len(times) != 0:
             results['file'].append(file_name)
@@ -109,12 +114,26 @@ def process_files(file_names, ibex_tools_dir, alpha, max_iter, prec, is_baseline
             results['max_time'].append(np.max(times))
             results['min_cells'].append(np.min(cells))
             results['max_cells'].append(np.max(cells))
+            timeouts = sum(1 for row in rows if row['timed_out'] == 1)
+            results['timeouts'].append(timeouts)
+            results['failed_runs'].append(len(rows) - len(succeeded) - timeouts)
+            results['avg_wall_time'].append(column_mean(succeeded, 'wall_time'))
+            results['avg_user_time'].append(column_mean(succeeded, 'user_time'))
+            results['avg_sys_time'].append(column_mean(succeeded, 'sys_time'))
+            results['max_rss_kb'].append(max((row['max_rss_kb'] for row in rows if row['max_rss_kb'] is not None), default=np.nan))
+            results['avg_major_faults'].append(column_mean(succeeded, 'major_faults'))
+            results['avg_involuntary_switches'].append(column_mean(succeeded, 'involuntary_switches'))
         else:
-            print("Warning: Attempted operation on empty array")
+            print(f"Warning: no successful run for {file_name} ({len(rows)} failed or timed out)")
 
     return pd.DataFrame(results).set_index(['file', 'params'])
 
 
+def process_latest(file_names, conn, alpha, max_iter, prec, is_baseline=False, campaign=DEFAULT_CAMPAIGN, pinned=False):
+    binary_hash = latest_binary(conn, is_baseline, alpha, max_iter, prec, pinned, campaign)
+    return process_files(file_names, conn, alpha, max_iter, prec, is_baseline, campaign, pinned, binary_hash)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--alpha', nargs='+', type=float, required=True)
@@ -123,6 +142,10 @@ def main():
     parser.add_argument('--ibex_tools_dir', type=str, required=True)
     parser.add_argument('--bench_list', type=str, required=True)
     parser.add_argument('--baseline_params', type=str, required=True)
+    parser.add_argument('--results_db', type=str, default=None)
+    parser.add_argument('--campaign', type=str, default=DEFAULT_CAMPAIGN)
+    parser.add_argument('--pinned', action='store_true')
+    parser.add_argument('--parquet', type=str, default=None)
     
     args = parser.parse_args()
     baseline_params = args.baseline_params.split(' ')
@@ -137,14 +160,19 @@ def main():
     with open(args.bench_list, 'r') as f:
         file_names = f.read().splitlines()
 
+    conn = open_results_db(args.results_db or f"{args.ibex_tools_dir}/results.db")
+    if args.parquet:
+        num_runs = export_parquet(conn, args.parquet, args.campaign)
+        print(f"Exported {num_runs} runs of campaign {args.campaign} to {args.parquet}")
+
     # Process baseline files
-    df_baseline = process_files(file_names, args.ibex_tools_dir, baseline_alpha, baseline_max_iter, baseline_prec, is_baseline=True)
+    df_baseline = process_latest(file_names, conn, baseline_alpha, baseline_max_iter, baseline_prec, is_baseline=True, campaign=args.campaign, pinned=args.pinned)
     df_baseline.to_csv(f"{args.ibex_tools_dir}/baseline_bench_data_{timestamp}.csv")
 
     # Loop over parameter values
     for alpha, max_iter, prec in itertools.product(args.alpha, args.max_iter, args.prec):
         print(f"Processing alpha={alpha}, max_iter={max_iter}, prec={prec}")
-        df = process_files(file_names, args.ibex_tools_dir, alpha, max_iter, prec)
+        df = process_latest(file_names, conn, alpha, max_iter, prec, campaign=args.campaign, pinned=args.pinned)
         df.to_csv(f"{args.ibex_tools_dir}/bench_data_{timestamp}_alpha_{alpha}_max_iter_{max_iter}_prec_{prec}.csv")
 
 
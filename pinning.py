@@ -0,0 +1,75 @@
+# ---------------------------------------------
+# Script: pinning.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module works out how run.py pins `ibexopt` jobs to CPUs in measurement-fidelity mode.
+# Logical CPUs are grouped into physical cores using the Linux sysfs topology, so that SMT
+# siblings can be left idle and the cores reserved for the harness (run.py itself, parsing and
+# background builds) are kept free of benchmark jobs.
+#
+# FUNCTIONS
+# ---------
+# - `physical_cores`: Returns the logical CPUs this process may use, grouped by physical core.
+#   Without topology information every logical CPU is treated as its own core.
+# - `pinning_slots`: Returns one CPU set per job slot. Physical cores that contain any CPU of
+#   `reserved_cpus` are skipped. With `one_job_per_core` each slot is the first logical CPU of a
+#   physical core, otherwise every logical CPU is a slot of its own.
+# - `harness_cpus`: Returns the CPUs left for the harness: every CPU of the reserved physical cores,
+#   or all usable CPUs if nothing is reserved.
+# - `pin_harness`: Moves the calling thread (and the threads it starts later) to the harness CPUs and returns
+#   the pinning state used by `run_ibexopt`: a queue of free job slots and the harness CPUs.
+# ---------------------------------------------
+
+import os
+import queue
+
+
+def read_topology(cpu, name):
+    with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/{name}", "r") as file:
+        return int(file.read())
+
+
+def physical_cores():
+    cores = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            core = (read_topology(cpu, "physical_package_id"), read_topology(cpu, "core_id"))
+        except (OSError, ValueError):
+            core = (0, cpu)
+        cores.setdefault(core, []).append(cpu)
+    return list(cores.values())
+
+
+def pinning_slots(reserved_cpus, one_job_per_core):
+    slots = []
+    for siblings in physical_cores():
+        if set(siblings) & set(reserved_cpus):
+            continue
+        if one_job_per_core:
+            slots.append({siblings[0]})
+        else:
+            slots.extend({cpu} for cpu in siblings)
+    return slots
+
+
+def harness_cpus(reserved_cpus):
+    cpus = set()
+    for siblings in physical_cores():
+        if set(siblings) & set(reserved_cpus):
+            cpus.update(siblings)
+    return cpus or set(os.sched_getaffinity(0))
+
+
+def pin_harness(reserved_cpus, one_job_per_core):
+    slots = pinning_slots(reserved_cpus, one_job_per_core)
+    if not slots:
+        raise ValueError(f"No cores left for jobs after reserving CPUs {sorted(reserved_cpus)}")
+    harness = harness_cpus(reserved_cpus)
+    # Threads started from here on, including the build thread, inherit the harness CPUs
+    os.sched_setaffinity(0, harness)
+    free_slots = queue.Queue()
+    for slot in slots:
+        free_slots.put(slot)
+    return free_slots, harness
@@ -0,0 +1,62 @@
+# ---------------------------------------------
+# Script: racing.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module implements the statistics behind run.py's racing mode, in the style of F-Race.
+# While a campaign is running, every parameter configuration is compared against the baseline
+# on the benchmarks it has completed so far. A configuration that is significantly slower is
+# eliminated, and its remaining jobs are not run.
+#
+# FUNCTIONS
+# ---------
+# - `wilcoxon_signed_rank`: One-sided Wilcoxon signed-rank test of whether paired differences are
+#   centered above zero. It uses the normal approximation with tie and continuity corrections, and
+#   drops zero differences. Returns the statistic W+ and the p-value.
+# - `race_test`: Compares a configuration with the baseline on the benchmarks both have results for.
+#   The paired values are the relative slowdowns (t_config - t_baseline) / t_baseline, so that long and
+#   short benchmarks weigh the same. Returns the number of benchmarks compared and the p-value, or None
+#   as p-value if fewer than `min_benchmarks` are available.
+# ---------------------------------------------
+
+import math
+
+
+def wilcoxon_signed_rank(differences):
+    differences = [d for d in differences if d != 0]
+    n = len(differences)
+    if n == 0:
+        return 0.0, 1.0
+
+    # Average ranks of the absolute differences, ties share the mean of their ranks
+    order = sorted(range(n), key=lambda i: abs(differences[i]))
+    ranks = [0.0] * n
+    tie_correction = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and abs(differences[order[j + 1]]) == abs(differences[order[i]]):
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_correction += ties ** 3 - ties
+        i = j + 1
+
+    w_plus = sum(rank for rank, d in zip(ranks, differences) if d > 0)
+    mean = n * (n + 1) / 4
+    variance = n * (n + 1) * (2 * n + 1) / 24 - tie_correction / 48
+    if variance <= 0:
+        return w_plus, 1.0
+    z = (w_plus - mean - 0.5) / math.sqrt(variance)
+    return w_plus, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def race_test(config_times, baseline_times, min_benchmarks):
+    benches = [bench for bench in config_times if baseline_times.get(bench)]
+    if len(benches) < min_benchmarks:
+        return len(benches), None
+    slowdowns = [(config_times[bench] - baseline_times[bench]) / baseline_times[bench] for bench in benches]
+    _, p_value = wilcoxon_signed_rank(slowdowns)
+    return len(benches), p_value
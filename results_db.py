@@ -0,0 +1,194 @@
+# ---------------------------------------------
+# Script: results_db.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module keeps every finished `ibexopt` run in a local SQLite database. A run is identified by
+# its benchmark, whether it belongs to the baseline, its parameters, the run number, the random seed,
+# the hash of the binary that produced it (the `build_cache.py` key), whether it was pinned to a
+# core (measurement-fidelity mode) and the campaign it belongs to. Campaigns are named by run.py's
+# `campaign` variable and do not share runs, so a new campaign measures everything again while a
+# restarted one picks up where it stopped. run.py records each run as soon as it finishes and skips the
+# runs that are already in the database, so an interrupted or extended campaign only executes the
+# missing ones. `parse_results.py` and `generate_results_csv.py`
+# read their data from the same database.
+#
+# FUNCTIONS
+# ---------
+# - `open_results_db`: Opens (and if needed creates) the database at the given path.
+# - `record_run`: Stores the outcome of one run, given as its key (in `RUN_KEY` order) and a dict of
+#   `RESULT_COLUMNS` values, replacing any earlier attempt of the same run.
+# - `completed_runs`: Returns the keys of all runs that produced a result or timed out.
+# - `recorded_seed`: Returns the seed a parameter combination was run with in a campaign, or None if it has no runs yet.
+# - `latest_binary`: Returns the hash of the binary that made the most recently finished run of a configuration in
+#   a campaign, or None if it has no runs yet.
+# - `run_results`: Returns every recorded run of one benchmark and configuration as a dict, ordered by run,
+#   including the runs that failed. Pinned and unpinned runs are never mixed, and with `binary_hash` only
+#   the runs of that binary are returned.
+# - `runtime_history`: Returns the average baseline CPU time of each benchmark over all recorded campaigns.
+# - `benchmark_means`: Returns the average CPU time of each benchmark for one configuration, seed, binary,
+#   pinning mode and campaign, counting only benchmarks with at least `min_runs` finished runs. Runs that timed out
+#   count as `par_k` times their cutoff (PAR-k).
+# - `export_parquet`: Writes the recorded runs to a Parquet dataset partitioned by campaign, with the same typed
+#   columns as the database, replacing the earlier export of the same campaigns. Needs pyarrow.
+#
+# Runs whose output could not be parsed are stored with NULL `cpu_time` and `num_cells`, so they are
+# kept for inspection but executed again by the next campaign. Runs killed at their cutoff are stored
+# with `timed_out` = 1 and their `cutoff`; they are censored results, not missing ones, and are not
+# executed again.
+# ---------------------------------------------
+
+import os
+import sqlite3
+import pandas as pd
+from datetime import datetime
+
+RUN_KEY = ['bench', 'is_baseline', 'alpha', 'max_iter', 'prec', 'run', 'seed', 'binary_hash', 'pinned', 'campaign']
+
+DEFAULT_CAMPAIGN = 'default'
+
+PARQUET_TYPES = {'INTEGER': 'Int64', 'REAL': 'float64', 'TEXT': 'string'}
+
+# Everything stored about a run besides its key. New columns are added to existing databases when they are opened.
+RESULT_COLUMNS = {
+    'cpu_time': 'REAL',
+    'num_cells': 'INTEGER',
+    'status': 'TEXT',
+    'f_lower': 'REAL',
+    'f_upper': 'REAL',
+    'relative_prec': 'REAL',
+    'absolute_prec': 'REAL',
+    'cpus': 'TEXT',
+    'exit_code': 'INTEGER',
+    'term_signal': 'INTEGER',
+    'timed_out': 'INTEGER',
+    'cutoff': 'REAL',
+    'wall_time': 'REAL',
+    'user_time': 'REAL',
+    'sys_time': 'REAL',
+    'max_rss_kb': 'INTEGER',
+    'minor_faults': 'INTEGER',
+    'major_faults': 'INTEGER',
+    'voluntary_switches': 'INTEGER',
+    'involuntary_switches': 'INTEGER',
+    'output_file': 'TEXT',
+    'finished_at': 'TEXT',
+}
+
+
+def open_results_db(db_path):
+    conn = sqlite3.connect(db_path)
+    table_info = conn.execute("PRAGMA table_info(runs)").fetchall()
+    old_columns = {row[1] for row in table_info}
+    old_key = [row[1] for row in sorted(table_info, key=lambda row: row[5]) if row[5]]
+    if old_key == RUN_KEY:
+        old_columns = set()
+    elif old_columns:
+        # Databases from before `pinned` or `campaign` were added lack them in the key, and SQLite cannot change
+        # a primary key in place. Their runs get the column defaults: unpinned, in the default campaign.
+        conn.execute("ALTER TABLE runs RENAME TO runs_before_migration")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS runs (
+            bench TEXT NOT NULL,
+            is_baseline INTEGER NOT NULL,
+            alpha REAL NOT NULL,
+            max_iter INTEGER NOT NULL,
+            prec REAL NOT NULL,
+            run INTEGER NOT NULL,
+            seed INTEGER NOT NULL,
+            binary_hash TEXT NOT NULL,
+            pinned INTEGER NOT NULL DEFAULT 0,
+            campaign TEXT NOT NULL DEFAULT 'default',
+            PRIMARY KEY (bench, is_baseline, alpha, max_iter, prec, run, seed, binary_hash, pinned, campaign)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS runs_campaign ON runs (campaign)")
+    existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+    for column, column_type in RESULT_COLUMNS.items():
+        if column not in existing_columns:
+            conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {column_type}")
+    if old_columns:
+        columns = ', '.join(sorted(old_columns & (set(RUN_KEY) | set(RESULT_COLUMNS))))
+        conn.execute(f"INSERT INTO runs ({columns}) SELECT {columns} FROM runs_before_migration")
+        conn.execute("DROP TABLE runs_before_migration")
+    conn.commit()
+    return conn
+
+
+def record_run(conn, key, result):
+    row = dict(zip(RUN_KEY, key))
+    row['is_baseline'] = int(row['is_baseline'])
+    row['pinned'] = int(row['pinned'])
+    row.update({column: result.get(column) for column in RESULT_COLUMNS})
+    row['finished_at'] = datetime.now().isoformat(timespec='seconds')
+    conn.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                 list(row.values()))
+    conn.commit()
+
+
+def completed_runs(conn):
+    rows = conn.execute(f"SELECT {', '.join(RUN_KEY)} FROM runs WHERE cpu_time IS NOT NULL OR timed_out = 1")
+    return {(bench, bool(is_baseline), alpha, max_iter, prec, run, seed, binary_hash, bool(pinned), campaign)
+            for bench, is_baseline, alpha, max_iter, prec, run, seed, binary_hash, pinned, campaign in rows}
+
+
+def recorded_seed(conn, alpha, max_iter, prec, pinned=False, campaign=DEFAULT_CAMPAIGN):
+    # A combination normally has a single seed; if an older version of run.py gave it several, the most used one wins
+    row = conn.execute("""
+        SELECT seed FROM runs
+        WHERE is_baseline = 0 AND alpha = ? AND max_iter = ? AND prec = ? AND pinned = ? AND campaign = ?
+        GROUP BY seed ORDER BY COUNT(*) DESC, seed LIMIT 1""", (alpha, max_iter, prec, int(pinned), campaign)).fetchone()
+    return row[0] if row else None
+
+
+def latest_binary(conn, is_baseline, alpha, max_iter, prec, pinned=False, campaign=DEFAULT_CAMPAIGN):
+    row = conn.execute("""
+        SELECT binary_hash FROM runs
+        WHERE is_baseline = ? AND alpha = ? AND max_iter = ? AND prec = ? AND pinned = ? AND campaign = ?
+        ORDER BY finished_at DESC LIMIT 1""", (int(is_baseline), alpha, max_iter, prec, int(pinned), campaign)).fetchone()
+    return row[0] if row else None
+
+
+def run_results(conn, bench, is_baseline, alpha, max_iter, prec, campaign=DEFAULT_CAMPAIGN, pinned=False, binary_hash=None):
+    query = """
+        SELECT * FROM runs
+        WHERE bench = ? AND is_baseline = ? AND alpha = ? AND max_iter = ? AND prec = ? AND campaign = ? AND pinned = ?"""
+    params = [bench, int(is_baseline), alpha, max_iter, prec, campaign, int(pinned)]
+    if binary_hash is not None:
+        query, params = query + " AND binary_hash = ?", params + [binary_hash]
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(query + " ORDER BY run", params)
+    return [dict(row) for row in rows]
+
+
+def runtime_history(conn):
+    rows = conn.execute("""
+        SELECT bench, AVG(cpu_time) FROM runs
+        WHERE is_baseline = 1 AND cpu_time IS NOT NULL
+        GROUP BY bench""")
+    return dict(rows.fetchall())
+
+
+def benchmark_means(conn, is_baseline, seed, binary_hash, min_runs=1, par_k=10, pinned=False, campaign=DEFAULT_CAMPAIGN):
+    rows = conn.execute("""
+        SELECT bench, AVG(CASE WHEN timed_out = 1 THEN ? * cutoff ELSE cpu_time END) FROM runs
+        WHERE is_baseline = ? AND seed = ? AND binary_hash = ? AND pinned = ? AND campaign = ?
+          AND (cpu_time IS NOT NULL OR timed_out = 1)
+        GROUP BY bench HAVING COUNT(*) >= ?""", (par_k, int(is_baseline), seed, binary_hash, int(pinned), campaign, min_runs))
+    return dict(rows.fetchall())
+
+
+def export_parquet(conn, directory, campaign=None):
+    query, params = "SELECT * FROM runs", []
+    if campaign is not None:
+        query, params = query + " WHERE campaign = ?", [campaign]
+    runs = pd.read_sql_query(query, conn, params=params)
+    # SQLite does not enforce column types, so the declared ones are applied before writing (nullable integers)
+    declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(runs)")}
+    runs = runs.astype({column: PARQUET_TYPES[declared[column]] for column in runs.columns})
+    runs = runs.astype({'is_baseline': bool, 'pinned': bool})
+    os.makedirs(directory, exist_ok=True)
+    # One directory per campaign; exporting a campaign again replaces its files instead of adding to them
+    runs.to_parquet(directory, partition_cols=['campaign'], index=False, existing_data_behavior='delete_matching')
+    return len(runs)
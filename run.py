@@ -6,8 +6,8 @@
 # --------
 # This Python script automates the running and benchmarking of optimization tasks using the Ibex 
 # library's `ibexopt` tool. It first runs a baseline benchmark for comparison, then conducts 
-# multiple test runs with a variety of parameter combinations. Finally, it analyzes the results 
-# using a Python script. By running tasks in parallel, the script efficiently leverages 
+# multiple test runs with a variety of parameter combinations. The output of every run is parsed
+# as soon as it finishes, so the results are analyzed right after the last run. By running tasks in parallel, the script efficiently leverages 
 # system resources for improved performance.
 #
 # PARAMETERS
@@ -16,62 +16,140 @@
 # - `ibex_dir`: Directory of Ibex library
 # - `tools_dir`: Directory of Ibex tools
 # - `input_file`: Name of the input file containing the list of benchmarks to run
-# - `python_interpreter`: Location of the Python interpreter
-# - `python_script`: Location of the Python script used to parse the results
-# - `ibexopt`: Location of the `ibexopt` executable
+# - `cpu_budget_hours`, `budget_families`, `budget_list_file`: Budget in CPU hours to select the benchmarks for, in place
+#    of `input_file`, see EXECUTION
+# - `ibexopt`: Location of the `ibexopt` executable produced by `./waf build`
 # - `header_file`: Location of the Ibex header file where the parameters are defined
+# - `build_cache_dir`: Directory holding one cached `ibexopt` binary per parameter configuration
+# - `build_jobs`: Number of parallel compile jobs used by background builds
+# - `results_db`: SQLite database where every finished run is recorded (see `results_db.py`)
+# - `campaign`: Name under which the runs are recorded; an invocation only reuses the runs of its own campaign
+# - `archive_outputs`: Store the raw outputs in a compressed archive per campaign (see `output_archive.py`)
 # - `num_runs`: Number of runs
 # - `max_jobs`: Maximum number of parallel jobs, adjust this to the number of CPU cores on your machine
 # - `alpha_values`, `max_iter_values`, `prec_values`: Lists of parameter combinations to test
 # - `baseline_alpha`, `baseline_max_iter`, `baseline_prec`, `baseline_num_runs`: Parameters for the baseline run
+# - `job_timeout`, `adaptive_cutoff`, `cutoff_min`, `par_k`: Time limits of the runs, see EXECUTION
+# - `pin_jobs`, `reserved_cpus`, `one_job_per_core`, `fidelity_target_error`: Measurement-fidelity mode, see EXECUTION
+# - `distributed`, `coordinator_address`, `coordinator_token`, `lease_seconds`, `worker_retries`: Distributed mode settings,
+#   see EXECUTION
+# - `status_interval`, `metrics_file`, `metrics_port`: Live status line and metrics of the campaign, see EXECUTION
+# - `racing`, `racing_min_benchmarks`, `racing_p_value`: Racing mode settings, see EXECUTION
+# - `search_mode`, `search_space`, `search_budget`, `search_initial`, `search_in_flight`, `search_seed`: Search mode
+#    settings, see EXECUTION
 #
 # FUNCTIONS
 # ---------
-# - `execute_ibexopt`: Executes the `ibexopt` tool with a given benchmark and stores the output in a text file. 
-#    It is run as a subprocess, allowing for parallel execution.
-# - `wait_for_jobs`: Waits until the number of subprocesses is below the maximum limit before returning.
-# - `run_python_script`: Runs the Python script to parse the results of the `ibexopt` executions.
-# - `apply_params`: Applies the parameters to the Ibex header file.
-# - `generate_results()`: Reads all the CSV files in the script directory, finds the baseline benchmark CSV file,
-#     extracts the parameter configurations from each CSV file name, merges the data from all CSVs into one DataFrame,
-#     calculates the improvement for each file, identifies the best parameters per file, counts how often each
+# - `execute_ibexopt`: Executes the configuration's cached `ibexopt` binary with a given benchmark and writes its output
+#    to the campaign's archive, or to a text file if `archive_outputs` is off, with `run_ibexopt` from `ibexopt_runner.py`.
+#    The output is parsed while it streams, and once the process exits the summary fields are returned together with its
+#    resource usage. It blocks until then, so it is meant to be run from a worker thread.
+# - `job_cutoff`: Returns the time limit of a run: `job_timeout`, or `adaptive_cutoff` times the benchmark's average
+#    baseline time (at least `cutoff_min`) if that is smaller. Baseline runs only get `job_timeout`.
+# - `submit_jobs`: Submits a batch of `execute_ibexopt` jobs to the worker pool. The pool has `max_jobs` threads,
+#    so a new job starts as soon as a slot is free and no more than `max_jobs` run at once. In distributed mode the
+#    jobs are queued on the coordinator instead (see `coordinator.py`).
+# - `longest_first`: Orders jobs by their benchmark's historical time, longest first, so short jobs fill the gaps at the end.
+# - `race_config`: Compares the benchmarks a combination has finished (all `num_runs` runs) with the baseline using
+#    the paired test in `racing.py`, and returns the number of benchmarks compared and the p-value.
+# - `print_prediction`: Prints the predicted CPU time of the campaign and, when the jobs run locally, its wall time on
+#    the worker pool, from the baseline times of earlier campaigns (see `cost_model.py`). Returns the predicted time
+#    of a run of each benchmark.
+# - `grid_seeds`: Returns the seed of every combination of the grid: the seed it was already run with in this campaign,
+#    or for a new combination its position in the grid (or the next unused seed if an existing combination has that one).
+# - `propose_config`: Asks the model in `search.py` for the next combination to evaluate in search mode.
+# - `apply_params`: Returns the cached `ibexopt` binary for a parameter configuration, building it first if the
+#    configuration (or the Ibex source) has not been built before. See `build_cache.py`.
+# - `generate_results()`: Reads the runs of this campaign's binaries from `results_db`, averages the time of each file
+#     for the baseline and every parameter configuration, calculates the improvement for each file, identifies the best parameters per file, counts how often each
 #     parameter configuration yields the best results, and writes the results to a new CSV file 'combined_results_data.csv'.
 #
 # EXECUTION
 # ---------
 # The script performs the following steps:
-# 1. It first runs the baseline benchmark with defined baseline parameters.
-# 2. Next, it proceeds with the main loop for other parameter combinations, which includes the following steps:
-#    - Updates the Ibex header file with the new parameter values.
-#    - Rebuilds the Ibex library.
-#    - Executes the `ibexopt` tool for each benchmark in the input file, up to `num_runs` times each. 
-#      These executions are done as subprocesses, up to `max_jobs` concurrent subprocesses.
-#    - Waits for all `ibexopt` subprocesses to finish.
-#    - Increments the loop counter and starts again with the next parameter combination.
-# 3. After all parameter combinations have been tested, the Python script to parse the results is run.
-# 4. Calls the `generate_results()` function to generate a combined CSV file of the results.
+# 0. It reads the benchmarks from `input_file`, or with `cpu_budget_hours` it selects them from the `budget_families`
+#    of `benchs/optim` so that the whole campaign fits the budget, covering each family and the range of difficulty
+#    (see `cost_model.py`), and writes the selection to `budget_list_file`. Either way it prints the predicted CPU and
+#    wall time of the full campaign, ignoring builds; benchmarks that were never run are predicted from their family.
+# 1. It queues a build for the baseline and for every parameter combination. Builds run one at a time in a
+#    background thread; a combination that was built before is taken from `build_cache_dir` without compiling.
+# 2. As soon as a combination's binary is ready, every run of every benchmark in the input file (`num_runs` each,
+#    `baseline_num_runs` for the baseline) that is not yet in `results_db` is queued, longest benchmarks first, using
+#    the average baseline times recorded by earlier campaigns. The jobs are executed by a pool of
+#    `max_jobs` worker threads, each running one `ibexopt` process at a time, so the benchmarks of one combination
+#    run while the next one is being built. The output of each run is parsed while it streams and the summary is
+#    recorded in `results_db` as soon as the process exits, so an interrupted campaign can simply be restarted, and
+#    extending the parameter lists only runs the new combinations.
+#    If a combination cannot be built, its runs are skipped; a failed baseline build, an error or Ctrl-C stops the
+#    campaign: the queued jobs are cancelled and the running `ibexopt` processes are killed.
+#    A run that reaches its cutoff (see `job_cutoff`) has its process group killed and is recorded as censored
+#    (`timed_out`) rather than missing. The baseline times used by the adaptive cutoff come from earlier campaigns and
+#    are updated as this campaign's baseline runs finish. Wherever times are compared, censored runs count as `par_k`
+#    times their cutoff (PAR-k).
+#    In measurement-fidelity mode (`pin_jobs`), each job is pinned to a core of its own (see `pinning.py`). The physical
+#    cores of `reserved_cpus` are left to run.py and the builds, and with `one_job_per_core` SMT siblings stay idle, so
+#    the number of parallel jobs is the number of free physical cores rather than `max_jobs`. Pinned runs are recorded
+#    separately from unpinned ones, and at the end `fidelity_report.py` prints the run-to-run variance of both setups
+#    together with the number of runs each one needs.
+#    In distributed mode, the jobs are not run here but handed out by a coordinator to workers on other machines
+#    (`worker.py`), which download the binaries and benchmark files they need and send back the parsed results. Builds,
+#    racing, search and the results database stay on this machine. A job whose worker stops renewing its lease for
+#    `lease_seconds` is queued again, so losing a worker only delays its running jobs. A job a worker could not run is
+#    queued again up to `worker_retries` times and then recorded as a failed run. The coordinator only listens on
+#    this machine by default; to accept workers from other machines, `coordinator_address` must be set to another
+#    interface together with a `coordinator_token` that the workers send with every request.
+#    In racing mode, every time a run of a combination finishes, the combination is compared with the baseline on the
+#    benchmarks it has completed. Once at least `racing_min_benchmarks` benchmarks are available and the combination is
+#    significantly slower (p < `racing_p_value`), it is eliminated and its remaining queued jobs are cancelled.
+#    In search mode, the grid is replaced by `search_budget` combinations taken from `search_space` and proposed by
+#    `search.py`, `search_in_flight` at a time. When all runs of a combination (and of the baseline) are done, its mean
+#    improvement over the baseline is fed back to the model. Combination k is proposed and built once combinations
+#    1..k-`search_in_flight` are all scored, and the model sees exactly those as scored and the others as running, so
+#    the proposals do not depend on which combination happened to finish first and a restarted search repeats them.
+#    While the campaign runs, a status line is refreshed every `status_interval` seconds with the jobs done, running
+#    and queued, jobs/s, how busy the job slots and CPUs are, the time spent building and in jobs, the ETA and the
+#    best running improvement, and the same metrics (with the improvement of every combination) are written to
+#    `metrics_file` and served on `localhost:{metrics_port}` (see `telemetry.py`).
+# 3. After all jobs have finished, calls the `generate_results()` function to generate a combined CSV file of the results.
 #
-# The output of each `ibexopt` execution is saved to a text file in the `outputs` directory. The filename contains the 
+# The output of each `ibexopt` execution is saved to the `outputs` directory, compressed into the campaign's archive
+# `{campaign}.gz` or, with `archive_outputs` off, as a text file. The name of a run's output contains the
 # name of the benchmark file, the run number, the parameter combination, and for baseline runs, it is prefixed with `baseline_`.
+# `python3 output_archive.py outputs/{campaign}.gz` lists the outputs of an archive, and adding a name prints that output.
 # ---------------------------------------------
 
 
 
-import os
-import subprocess
-import time
 import itertools
-from multiprocessing import Pool, cpu_count
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from generate_results_csv import generate_results
+from build_cache import build_config, source_revision, binary_hash
+from ibexopt_runner import run_ibexopt, output_name, kill_running
+from output_archive import output_reference, archive_path
+from results_db import open_results_db, record_run, completed_runs, runtime_history, benchmark_means, recorded_seed
+from racing import race_test
+from search import propose, mean_improvement
+from pinning import pin_harness
+from fidelity_report import fidelity_report
+from coordinator import Coordinator
+from cost_model import benchmark_costs, predict_costs, budget_bench_list, predict_wall_time, list_benchmarks
+from telemetry import Telemetry
 # Variable definitions
 ibex_dir="/home/mateo/Desktop/ibex-lib"  # Directory of ibex-lib
 tools_dir="/home/mateo/Desktop/ibex-tools"  # Directory of ibex-tools
 input_file=f"{tools_dir}/bench_list"  # Name of the input file
-python_interpreter="/usr/bin/python3"  # Python interpreter location
-python_script=f"{tools_dir}/parse_results.py"  # Python script location
-ibexopt=f"{ibex_dir}/__build__/src/ibexopt"  # ibexopt location
+cpu_budget_hours=None  # Select the benchmarks to fit this many CPU hours from past results instead of reading input_file
+budget_families=["easy", "medium"]  # Families (directories of benchs/optim) the budgeted benchmarks are taken from
+budget_list_file=f"{tools_dir}/bench_list (budget)"  # File the budgeted bench list is written to
+ibexopt=f"{ibex_dir}/__build__/src/ibexopt"  # ibexopt location, as produced by `./waf build`
 header_file=f"{ibex_dir}/src/loup/ibex_LoupFinderIterative.h"  # Header file location
+build_cache_dir=f"{tools_dir}/build_cache"  # One cached ibexopt binary per parameter configuration
+build_jobs=2  # Number of parallel compile jobs for background builds
+results_db=f"{tools_dir}/results.db"  # SQLite database holding every finished run
+campaign="default"  # Name of the campaign, runs are only reused by later invocations with the same name
+archive_outputs=True  # Store the raw outputs in one compressed archive per campaign instead of one text file per run
 
 num_runs=3  # Number of runs per parameter combination
 # Maximum number of parallel jobs, adjust this to the number of CPU cores on your machine
@@ -90,84 +168,292 @@ baseline_prec=1e-3
 baseline_num_runs=5
 baseline_params = (baseline_alpha, baseline_max_iter, baseline_prec)
 
+# Timeouts: runs that exceed their cutoff are killed and recorded as censored
+job_timeout=None  # Absolute time limit of every run in seconds, None for no limit
+adaptive_cutoff=10  # Kill a run after this many times its benchmark's average baseline time, None to disable
+cutoff_min=1.0  # Lower bound of the adaptive cutoff in seconds, so very short benchmarks are not cut by noise
+par_k=10  # Censored runs count as par_k times their cutoff (PAR-k) when times are compared
 
-def execute_ibexopt(file_path, run, loop_number, is_baseline, alpha, max_iter, prec):
-    file_name = os.path.basename(file_path)
-    output_prefix = "baseline_" if is_baseline else ""
-    alpha_str = str(alpha).replace(".", ",")
-    max_iter_str = str(max_iter)
-    prec_str = str(prec).replace(".", ",")
-    output_params = f"_alpha{alpha_str}_maxIter{max_iter_str}_prec{prec_str}"
-    output_file = f"{tools_dir}/outputs/{output_prefix}{file_name+output_params}-{run}.txt"
-    cmd = f"{ibexopt} {ibex_dir}/benchs/optim/{file_path}.bch --random-seed={loop_number} > {output_file}"
-    return subprocess.Popen(cmd, shell=True)
-
-
-def wait_for_jobs():
-    while True:
-        if len(subprocess.check_output("jobs -p", shell=True).splitlines()) < max_jobs:
-            return
-        time.sleep(1)
-
-
-def run_python_script(script):
-    alpha_str = ' '.join(map(str, alpha_values))
-    max_iter_str = ' '.join(map(str, max_iter_values))
-    prec_str = ' '.join(map(str, prec_values))
-    baseline_str = ' '.join(map(str, baseline_params))
-    cmd = f"{python_interpreter} {script} --alpha {alpha_str} --max_iter {max_iter_str} --prec {prec_str} --baseline_params \"{baseline_str}\" --ibex_tools_dir {tools_dir} --bench_list {input_file}"
-    subprocess.run(cmd, shell=True)
-
-def apply_params(alpha, max_iter, prec):
-    with open(header_file, "r") as file:
-        filedata = file.read()
-
-    filedata = filedata.replace("double alpha=", f"double alpha={alpha}")
-    filedata = filedata.replace("int max_iter=", f"int max_iter={max_iter}")
-    filedata = filedata.replace("double prec=", f"double prec={prec}")
-
-    with open(header_file, "w") as file:
-        file.write(filedata)
-
-    subprocess.run(f"cd {ibex_dir} && ./waf install > waf_install.log 2>/dev/null", shell=True)
-
-
-# Run the baseline benchmark
-print(f"Running baseline benchmark with parameters alpha={baseline_alpha}, max_iter={baseline_max_iter}, prec={baseline_prec}")
-apply_params(baseline_alpha, baseline_max_iter, baseline_prec)
-
-with open(input_file, "r") as file:
-    file_paths = file.read().splitlines()
-
-for run in range(1, baseline_num_runs + 1):
-    print(f"Starting run {run} out of {baseline_num_runs}")
-    processes = []
-    for file_path in file_paths:
-        wait_for_jobs()
-        p = execute_ibexopt(file_path, run, 1, True, baseline_alpha, baseline_max_iter, baseline_prec)
-        processes.append(p)
-    # Wait for all processes to finish
-    for p in processes:
-        p.wait()
-        
-# Now proceed with the main loop for other parameter combinations
-loop_number=1
-
-for alpha, max_iter, prec in itertools.product(alpha_values, max_iter_values, prec_values):
-    print(f"Starting loop {loop_number} out of {num_combinations}: parameters alpha={alpha}, max_iter={max_iter}, prec={prec}")
-    apply_params(alpha, max_iter, prec)
-
-    for run in range(1, num_runs + 1):
-        print(f"Starting run {run} out of {num_runs}")
-        processes = []
-        for file_path in file_paths:
-            wait_for_jobs()
-            p = execute_ibexopt(file_path, run, loop_number, False, alpha, max_iter, prec)
-            processes.append(p)
-        # Wait for all processes to finish
-        for p in processes:
-            p.wait()
-    loop_number += 1
-    
-run_python_script(python_script)
-generate_results(num_runs,baseline_num_runs)
\ No newline at end of file
+# Measurement fidelity: pin every job to its own core instead of running max_jobs unpinned jobs
+pin_jobs=False  # Enable pinning, max_jobs is then replaced by the number of free cores
+reserved_cpus={0}  # Logical CPUs whose physical cores are kept free for the harness and builds
+one_job_per_core=True  # Run one job per physical core and leave SMT siblings idle
+fidelity_target_error=0.02  # Relative standard error used to suggest num_runs in the variance report
+
+# Distributed execution: serve the jobs to workers on other machines (see worker.py) instead of running them here
+distributed=False  # Enable distributed mode, each worker then sets its own number of jobs and pin_jobs needs workers started with --pin_jobs
+coordinator_address=("127.0.0.1", 5555)  # Address and port the coordinator listens on, e.g. ("0.0.0.0", 5555) for workers on other machines
+coordinator_token=None  # Shared secret workers must send (worker.py --token), required unless the coordinator only listens on loopback
+lease_seconds=60  # A job whose worker has not renewed its lease for this long is queued again
+worker_retries=2  # Times a job is queued again after a worker failed to run it, before it is recorded as a failed run
+
+# Telemetry: live status line and metrics of the running campaign (see telemetry.py)
+status_interval=5  # Seconds between refreshes of the status line and the metrics, None to disable
+metrics_file=f"{tools_dir}/metrics.json"  # Metrics of the campaign as JSON, rewritten at every refresh, None to disable
+metrics_port=None  # Port of a local HTTP endpoint serving the same metrics, None to disable
+
+# Racing: stop running combinations that are significantly slower than the baseline
+racing=False  # Enable racing mode
+racing_min_benchmarks=10  # Number of finished benchmarks before a combination can be eliminated
+racing_p_value=0.05  # Significance level of the one-sided Wilcoxon signed-rank test
+
+# Search mode: propose combinations with Bayesian optimization instead of running the whole grid
+search_mode=False  # Enable search mode, the *_values lists above are then ignored
+search_space=((0.7, 0.95), (2, 12), (1e-5, 1e-3))  # (low, high) ranges of alpha, max_iter and prec
+search_budget=20  # Number of combinations to evaluate
+search_initial=5  # Number of random combinations before the model is used
+search_in_flight=2  # Number of combinations evaluated at the same time
+search_seed=0  # Random seed of the search
+
+
+def execute_ibexopt(file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary, baseline_times, pinning=None):
+    name = output_name(file_path, run, is_baseline, alpha, max_iter, prec)
+    if archive_outputs:
+        output_file = output_reference(archive_path(f"{tools_dir}/outputs", campaign), file_path, name)
+    else:
+        output_file = f"{tools_dir}/outputs/{name}"
+    cmd = [binary, f"{ibex_dir}/benchs/optim/{file_path}.bch", f"--random-seed={loop_number}"]
+    return run_ibexopt(cmd, output_file, job_cutoff(file_path, is_baseline, baseline_times), pinning)
+
+
+def job_cutoff(file_path, is_baseline, baseline_times):
+    cutoffs = [job_timeout] if job_timeout else []
+    # The baseline itself is only limited by the absolute timeout
+    if adaptive_cutoff and not is_baseline and baseline_times.get(file_path):
+        cutoffs.append(max(cutoff_min, adaptive_cutoff * baseline_times[file_path]))
+    return min(cutoffs) if cutoffs else None
+
+
+def longest_first(jobs, history):
+    # Benchmarks without history are treated as the longest ones, so an unexpectedly
+    # slow job never ends up at the tail of the queue.
+    return sorted(jobs, key=lambda job: history.get(job[0], float("inf")), reverse=True)
+
+
+def submit_jobs(executor, jobs, baseline_times, pinning):
+    if distributed:
+        # Workers fetch the jobs in this order, and the cutoff is computed when a job is handed out
+        return {executor.submit(job, baseline_times): job for job in jobs}
+    # Each worker thread blocks on its own ibexopt child, so at most max_jobs
+    # processes run at once and a queued job starts as soon as a slot frees up.
+    return {executor.submit(execute_ibexopt, *job, baseline_times, pinning): job for job in jobs}
+
+
+def apply_params(alpha, max_iter, prec, revision):
+    return build_config(ibex_dir, header_file, ibexopt, build_cache_dir, revision, alpha, max_iter, prec, build_jobs)
+
+
+def race_config(conn, loop_number, binary, baseline_binary):
+    # Only benchmarks whose runs have all finished take part in the comparison
+    config_times = benchmark_means(conn, False, loop_number, binary_hash(binary), num_runs, par_k, pin_jobs, campaign)
+    baseline_times = benchmark_means(conn, True, 1, binary_hash(baseline_binary), baseline_num_runs, par_k, pin_jobs, campaign)
+    return race_test(config_times, baseline_times, racing_min_benchmarks)
+
+
+def propose_config(proposed, scores, loop_number):
+    # Proposal k sees proposals 1..k-search_in_flight as scored and the ones after as running, whichever of them
+    # actually finished first. Together with the seed, this makes a restarted search propose the same combinations
+    # again and find their runs in the results database.
+    rng = np.random.default_rng([search_seed, loop_number])
+    scored = loop_number - search_in_flight
+    observations = [(proposed[i], scores[i]) for i in range(1, scored + 1) if scores[i] is not None]
+    running = [proposed[i] for i in range(max(1, scored + 1), loop_number)]
+    return propose(observations, running, search_space, search_initial, rng)
+
+
+def grid_seeds(conn):
+    combinations = list(itertools.product(alpha_values, max_iter_values, prec_values))
+    # A combination keeps the seed it was first run with, so changing the grid never re-runs it under another seed
+    seeds = {}
+    for params in combinations:
+        seed = recorded_seed(conn, *params, pin_jobs, campaign)
+        seeds[params] = seed if seed not in seeds.values() else None
+    used = {seed for seed in seeds.values() if seed is not None}
+    next_seed = max(used | {len(combinations)}) + 1
+    for position, params in enumerate(combinations, start=1):
+        if seeds[params] is None:
+            # New combinations take their position in the grid, unless an existing combination already has that seed
+            if position in used:
+                position, next_seed = next_seed, next_seed + 1
+            seeds[params] = position
+            used.add(position)
+    return seeds
+
+
+def print_prediction(costs, file_paths, num_workers, total_configs):
+    predicted, unknown = predict_costs(costs, file_paths)
+    # Each configuration's jobs are queued longest first, and the configurations follow each other
+    job_times = []
+    for runs in [baseline_num_runs] + [num_runs] * total_configs:
+        job_times += sorted((predicted[file_path] for file_path in file_paths for _ in range(runs)), reverse=True)
+    print(f"Predicted campaign: {len(job_times)} runs, {sum(job_times) / 3600:.2f} CPU hours "
+          f"({len(unknown)} of {len(file_paths)} benchmarks without history)")
+    if not distributed:
+        print(f"Predicted wall time on {num_workers} jobs: {predict_wall_time(job_times, num_workers) / 3600:.2f} hours")
+    return predicted
+
+
+def main():
+    conn = open_results_db(results_db)
+    history = runtime_history(conn)
+    done = completed_runs(conn)
+    costs = benchmark_costs(conn, par_k)
+    # Identifies the Ibex sources, computed once so every cache key of the campaign uses the same revision
+    revision = source_revision(ibex_dir)
+
+    # The baseline comes first, followed by every parameter combination. In search mode the
+    # combinations are proposed one by one while the campaign runs.
+    configs = [(True, 1, baseline_params, baseline_num_runs)]
+    if not search_mode:
+        configs += [(False, seed, params, num_runs) for params, seed in grid_seeds(conn).items()]
+    total_configs = search_budget if search_mode else num_combinations
+
+    if cpu_budget_hours is None:
+        with open(input_file, "r") as file:
+            file_paths = file.read().splitlines()
+    else:
+        candidates = list_benchmarks(f"{ibex_dir}/benchs/optim", budget_families)
+        file_paths, cost = budget_bench_list(costs, candidates, cpu_budget_hours * 3600,
+                                             baseline_num_runs + num_runs * total_configs)
+        with open(budget_list_file, "w") as file:
+            file.write("\n".join(file_paths) + "\n")
+        print(f"Selected {len(file_paths)} of {len(candidates)} benchmarks for {cost / 3600:.2f} of {cpu_budget_hours} "
+              f"CPU hours, written to {budget_list_file}")
+
+    num_workers = max_jobs
+    pinning = None
+    if pin_jobs and not distributed:
+        pinning = pin_harness(reserved_cpus, one_job_per_core)
+        num_workers = pinning[0].qsize()
+        print(f"Pinning {num_workers} jobs to their own cores, harness and builds on CPUs {sorted(pinning[1])}")
+    predicted = print_prediction(costs, file_paths, num_workers, total_configs)
+
+    binaries = {}  # (is_baseline, loop_number) -> binary
+    remaining = {}  # (is_baseline, loop_number) -> number of queued jobs that have not finished yet
+    eliminated = set()
+    failed_builds = set()  # loop numbers whose binary could not be built
+    started = 0  # combinations whose jobs have been queued
+    proposed = {}  # loop_number -> parameters of every search proposal
+    scores = {}  # loop_number -> mean improvement of scored search proposals, None if it could not be computed
+    if distributed:
+        # Workers run the benchmarks from their own copy of ibex-lib/benchs/optim, downloaded from here
+        executor = Coordinator(coordinator_address, f"{ibex_dir}/benchs/optim", lease_seconds, job_cutoff, pin_jobs,
+                                campaign if archive_outputs else None, coordinator_token, worker_retries)
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+    telemetry = Telemetry(None if distributed else num_workers, predicted, par_k, status_interval, metrics_file, metrics_port)
+    with ThreadPoolExecutor(max_workers=1) as build_executor, executor, telemetry:
+        try:
+            # Builds run one at a time in the background, so combination N+1 compiles while
+            # the jobs of combination N are already running from its cached binary.
+            builds = {build_executor.submit(telemetry.timed_build, apply_params, *config[2], revision): config for config in configs}
+            num_proposed = min(search_in_flight, search_budget) if search_mode else 0
+            for loop_number in range(1, num_proposed + 1):
+                proposed[loop_number] = propose_config(proposed, scores, loop_number)
+                builds[build_executor.submit(telemetry.timed_build, apply_params, *proposed[loop_number], revision)] = (False, loop_number, proposed[loop_number], num_runs)
+            futures = {}
+            pending = set(builds)
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in builds:
+                        is_baseline, loop_number, (alpha, max_iter, prec), runs = builds[future]
+                        try:
+                            binary = future.result()
+                        except Exception as error:
+                            # Every combination is compared with the baseline, so there is no campaign without it
+                            if is_baseline:
+                                raise
+                            print(f"Build of loop {loop_number} failed, skipping its runs: parameters alpha={alpha}, "
+                                  f"max_iter={max_iter}, prec={prec}: {error}")
+                            failed_builds.add(loop_number)
+                            remaining[(False, loop_number)] = 0
+                            continue
+                        binaries[(is_baseline, loop_number)] = binary
+                        if is_baseline:
+                            print(f"Running baseline benchmark with parameters alpha={alpha}, max_iter={max_iter}, prec={prec}")
+                        else:
+                            started += 1
+                            # The loop number is the combination's seed, which need not follow the grid order
+                            print(f"Starting loop {loop_number} ({started} out of {total_configs}): parameters alpha={alpha}, max_iter={max_iter}, prec={prec}")
+                        jobs = [(file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary)
+                                for run in range(1, runs + 1)
+                                for file_path in file_paths
+                                if (file_path, is_baseline, alpha, max_iter, prec, run, loop_number, binary_hash(binary), pin_jobs, campaign) not in done]
+                        print(f"Queueing {len(jobs)} of {runs * len(file_paths)} runs, the others are already in {results_db}")
+                        submitted = submit_jobs(executor, longest_first(jobs, history), history, pinning)
+                        futures.update(submitted)
+                        telemetry.queued(submitted)
+                        pending.update(submitted)
+                        remaining[(is_baseline, loop_number)] = len(submitted)
+                    else:
+                        file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary = futures[future]
+                        remaining[(is_baseline, loop_number)] -= 1
+                        result = None if future.cancelled() else future.result()
+                        telemetry.finished(future, futures[future], result)
+                        if result is None:
+                            continue
+                        record_run(conn, (file_path, is_baseline, alpha, max_iter, prec, run, loop_number, binary_hash(binary), pin_jobs, campaign),
+                                   result)
+                        if is_baseline:
+                            # Adaptive cutoffs of jobs that have not started yet use this campaign's baseline times
+                            history.update(benchmark_means(conn, True, 1, binary_hash(binary), 1, par_k, pin_jobs, campaign))
+
+                        if racing and not is_baseline and loop_number not in eliminated:
+                            compared, p_value = race_config(conn, loop_number, binary, binaries[(True, 1)])
+                            if p_value is not None and p_value < racing_p_value:
+                                eliminated.add(loop_number)
+                                print(f"Eliminating loop {loop_number}: parameters alpha={alpha}, max_iter={max_iter}, prec={prec} "
+                                      f"are slower than the baseline on {compared} benchmarks (p={p_value:.3g})")
+                                for job_future, job in futures.items():
+                                    if job[2] == loop_number and not job[3]:
+                                        job_future.cancel()
+
+                # A search proposal is scored once its jobs and the baseline's jobs are all done. Proposal k is
+                # made once proposals 1..k-search_in_flight are all scored, see propose_config.
+                if search_mode and remaining.get((True, 1)) == 0:
+                    for loop_number, params in sorted(proposed.items()):
+                        if loop_number in scores or remaining.get((False, loop_number)) != 0:
+                            continue
+                        if loop_number in failed_builds:
+                            improvement = None
+                        else:
+                            improvement = mean_improvement(
+                                benchmark_means(conn, False, loop_number, binary_hash(binaries[(False, loop_number)]), 1, par_k, pin_jobs, campaign),
+                                benchmark_means(conn, True, 1, binary_hash(binaries[(True, 1)]), 1, par_k, pin_jobs, campaign))
+                        if improvement is None:
+                            print(f"Loop {loop_number}: no benchmark finished for both this combination and the baseline")
+                        else:
+                            print(f"Loop {loop_number}: parameters alpha={params[0]}, max_iter={params[1]}, prec={params[2]} "
+                                  f"improve on the baseline by {improvement:.2f}%")
+                        scores[loop_number] = improvement
+                    while num_proposed < search_budget and all(i in scores for i in range(1, num_proposed + 2 - search_in_flight)):
+                        num_proposed += 1
+                        proposed[num_proposed] = propose_config(proposed, scores, num_proposed)
+                        build = build_executor.submit(telemetry.timed_build, apply_params, *proposed[num_proposed], revision)
+                        builds[build] = (False, num_proposed, proposed[num_proposed], num_runs)
+                        pending.add(build)
+        except BaseException:
+            # Leaving the with block waits for the executors, which would otherwise run every queued job first
+            print("Stopping the campaign, cancelling the queued jobs")
+            build_executor.shutdown(wait=False, cancel_futures=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+            kill_running()
+            raise
+
+    observations = [(proposed[loop_number], score) for loop_number, score in scores.items() if score is not None]
+    if search_mode and observations:
+        (alpha, max_iter, prec), improvement = max(observations, key=lambda observation: observation[1])
+        print(f"Best parameters found: alpha={alpha}, max_iter={max_iter}, prec={prec}, improving on the baseline by {improvement:.2f}%")
+    conn.close()
+
+    generate_results(num_runs,baseline_num_runs,results_db=results_db,par_k=par_k,pinned=pin_jobs,campaign=campaign,
+                     binary_seeds={(binary_hash(binary), seed) for (_, seed), binary in binaries.items()})
+
+    if pin_jobs:
+        print("Run-to-run variance of the recorded CPU times:")
+        print(fidelity_report(results_db, fidelity_target_error).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# ---------------------------------------------
+# Script: run_stats.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module holds the statistics `generate_results` computes from the individual runs, so that the
+# best parameters of a benchmark are not picked on averages alone. Solver times are noisy, and with a
+# few runs per configuration the fastest average is often just luck. Everything is computed with
+# NumPy on all groups at once: runs are laid out as one row per (benchmark, configuration), padded
+# to the largest number of runs, and resampled together.
+#
+# Per benchmark and configuration:
+# - the improvement over the baseline with a bootstrap confidence interval. The runs of the
+#   configuration and of the baseline are resampled independently, because they use different seeds
+#   and are not paired;
+# - for the configuration with the lowest average time, `p_best`: the fraction of bootstrap samples in
+#   which it is still the fastest configuration on that benchmark.
+# Per configuration, over the benchmarks it shares with the baseline:
+# - the shifted geometric mean of its average times, exp(mean(log(t + shift))) - shift, the improvement
+#   of that mean over the baseline's, and a confidence interval from resampling the benchmarks;
+# - the one-sided p-value of a Wilcoxon signed-rank test of whether it is faster than the baseline,
+#   paired by benchmark on the relative time differences, as in `racing.py`.
+#
+# FUNCTIONS
+# ---------
+# - `pad_groups`: Lays out values by group as a NaN-padded matrix with one row per group.
+# - `bootstrap_means`: Resamples every row of one or more padded matrices, the same way for each matrix, and
+#   returns the means of each sample. Rows in the same slot share their resampling weights; rows in different
+#   slots are resampled independently.
+# - `average_ranks`: Ranks the values of every row of a matrix, ties sharing their average rank.
+# - `wilcoxon_faster`: One-sided Wilcoxon signed-rank p-values of every row of a matrix of differences being
+#   centered below zero, with the normal approximation and tie and continuity corrections.
+# - `row_percentiles`: Percentiles of every row of a matrix.
+# - `shifted_geometric_mean`: Shifted geometric mean of every row of a matrix, ignoring NaN.
+# - `compare_runs`: Computes the per-benchmark statistics from a DataFrame of runs.
+# - `compare_configs`: Computes the per-configuration statistics from the average times of each benchmark.
+# ---------------------------------------------
+
+import math
+import numpy as np
+import pandas as pd
+
+BLOCK_SIZE = 1 << 22  # Bootstrap means kept in memory at once by `compare_runs`
+
+
+def pad_groups(group_ids, values, num_groups):
+    order = np.argsort(group_ids, kind='stable')
+    ids = group_ids[order]
+    counts = np.bincount(ids, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+    padded = np.full((num_groups, max(counts.max(initial=0), 1)), np.nan)
+    padded[ids, np.arange(len(ids)) - starts[ids]] = values[order]
+    return padded, counts
+
+
+def bootstrap_means(padded_values, counts, n_boot, rng, slots=None):
+    # Rows with the same number of values and the same slot share their resampling weights, so each of these
+    # sets is resampled with a single matrix product. Rows that are compared with each other must therefore
+    # be given different slots, so that their samples are independent.
+    slots = np.zeros(len(counts), dtype=np.intp) if slots is None else slots
+    # Single precision is plenty for confidence intervals and halves the memory traffic of the samples
+    means = [np.full((len(counts), n_boot), np.nan, dtype=np.float32) for _ in padded_values]
+    if len(counts) == 0:
+        return means
+    order = np.lexsort((slots, counts))
+    keys = np.column_stack([counts[order], slots[order]])
+    bounds = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1), True])
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        count = counts[order[first]]
+        if count == 0:
+            continue
+        rows = order[first:last]
+        # Row i of weights holds how often each value is drawn in sample i, divided by the number of draws
+        weights = (rng.multinomial(count, np.full(count, 1 / count), size=n_boot) / count).astype(np.float32)
+        for padded, mean in zip(padded_values, means):
+            mean[rows] = padded[rows, :count].astype(np.float32) @ weights.T
+    return means
+
+
+def average_ranks(values):
+    # Ranks of the non-NaN values of each row (1-based), and the tie correction sum(t^3 - t) of each row
+    rows, cols = np.nonzero(~np.isnan(values))
+    flat = values[rows, cols]
+    order = np.lexsort((flat, rows))
+    rows, cols, flat = rows[order], cols[order], flat[order]
+    row_starts = np.searchsorted(rows, np.arange(values.shape[0]))
+    positions = np.arange(len(flat)) - row_starts[rows]
+    new_tie = np.ones(len(flat), dtype=bool)
+    new_tie[1:] = (rows[1:] != rows[:-1]) | (flat[1:] != flat[:-1])
+    tie_ids = np.cumsum(new_tie) - 1
+    tie_first = positions[new_tie]
+    tie_sizes = np.bincount(tie_ids)
+    ranks = np.full(values.shape, np.nan)
+    ranks[rows, cols] = tie_first[tie_ids] + (tie_sizes[tie_ids] - 1) / 2 + 1
+    tie_correction = np.bincount(rows[new_tie], weights=tie_sizes ** 3 - tie_sizes, minlength=values.shape[0])
+    return ranks, tie_correction
+
+
+def wilcoxon_faster(differences):
+    differences = np.where(differences == 0, np.nan, differences)
+    ranks, tie_correction = average_ranks(np.abs(differences))
+    n = (~np.isnan(differences)).sum(axis=1)
+    w_plus = np.where(differences > 0, ranks, 0.0).sum(axis=1)
+    mean = n * (n + 1) / 4
+    variance = n * (n + 1) * (2 * n + 1) / 24 - tie_correction / 48
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = (w_plus - mean + 0.5) / np.sqrt(variance)
+    p_values = 0.5 * np.vectorize(math.erfc)(-z / math.sqrt(2))
+    return np.where(variance > 0, p_values, 1.0)
+
+
+def row_percentiles(samples, percentiles):
+    # np.percentile(samples, percentiles, axis=1), computed by sorting: with many short rows this is several times
+    # faster than the partitioning np.percentile does. Rows containing NaN give NaN.
+    samples = np.sort(samples, axis=1)
+    width = samples.shape[1]
+    result = []
+    for position in np.asarray(percentiles) / 100 * (width - 1):
+        below = int(math.floor(position))
+        above = min(below + 1, width - 1)
+        fraction = position - below
+        result.append(np.where(np.isnan(samples[:, -1]), np.nan, samples[:, below] * (1 - fraction) + samples[:, above] * fraction))
+    return result
+
+
+def shifted_geometric_mean(times, shift):
+    with np.errstate(invalid='ignore'):
+        return np.exp(np.nanmean(np.log(times + shift), axis=1)) - shift
+
+
+def compare_runs(runs, n_boot=1000, confidence=0.95, rng=None):
+    # runs: one row per run with columns file, is_baseline, parameters and time (NaN for failed runs)
+    rng = rng or np.random.default_rng(0)
+    runs = runs.dropna(subset=['time'])
+    # The baseline is labelled '' so that it sorts first: every file is a contiguous block of groups, baseline first
+    labels = runs['parameters'].where(~runs['is_baseline'].astype(bool), '')
+    groups = pd.DataFrame({'file': runs['file'], 'parameters': labels})
+    group_keys = groups.drop_duplicates().sort_values(['file', 'parameters']).reset_index(drop=True)
+    group_keys['group'] = np.arange(len(group_keys))
+    group_ids = groups.merge(group_keys, on=['file', 'parameters'], how='left')['group'].to_numpy()
+    padded, counts = pad_groups(group_ids, runs['time'].to_numpy(dtype=float), len(group_keys))
+
+    is_baseline = (group_keys['parameters'] == '').to_numpy()
+    file_ids = pd.factorize(group_keys['file'])[0]
+    file_starts = np.searchsorted(file_ids, np.arange(file_ids.max(initial=-1) + 1))
+    baseline_rows = np.where(is_baseline[file_starts], file_starts, -1)[file_ids]
+    lower, upper = 50 * (1 - confidence), 50 * (1 + confidence)
+
+    improvement_low = np.full(len(group_keys), np.nan)
+    improvement_high = np.full(len(group_keys), np.nan)
+    p_best = np.full(len(group_keys), np.nan)
+    # The groups of a file are compared with each other, so each gets its own slot (its position in the file).
+    # Groups of different files are never compared and may share resampling weights.
+    slots = np.arange(len(group_keys)) - file_starts[file_ids]
+    # Whole files are resampled together, a block of files at a time to bound the memory of the samples
+    files_per_block = max(1, int(BLOCK_SIZE * len(file_starts) / (n_boot * max(len(group_keys), 1))))
+    bounds = list(file_starts[::files_per_block]) + [len(group_keys)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        means, = bootstrap_means([padded[start:stop]], counts[start:stop], n_boot, rng, slots[start:stop])
+        block_baseline = baseline_rows[start:stop] - start
+        has_baseline = (block_baseline >= 0) & ~is_baseline[start:stop]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            improvements = 100 * (1 - means[has_baseline] / means[block_baseline[has_baseline]])
+        rows = np.arange(start, stop)[has_baseline]
+        if len(rows):
+            improvement_low[rows], improvement_high[rows] = row_percentiles(improvements, [lower, upper])
+
+        # Fraction of samples in which the configuration with the lowest average stays the fastest of its file
+        configs = np.arange(start, stop)[~is_baseline[start:stop]]
+        if len(configs) == 0:
+            continue
+        config_files = file_ids[configs]
+        config_starts = np.flatnonzero(np.r_[True, config_files[1:] != config_files[:-1]])
+        point_means = np.nanmean(padded[configs], axis=1)
+        best = [configs[first + np.argmin(point_means[first:last])]
+                for first, last in zip(config_starts, list(config_starts[1:]) + [len(configs)])]
+        fastest = np.minimum.reduceat(means[configs - start], config_starts, axis=0)
+        p_best[best] = (means[np.array(best) - start] <= fastest).mean(axis=1)
+
+    result = group_keys.loc[~is_baseline, ['file', 'parameters']].copy()
+    result['improvement_ci_low'] = improvement_low[~is_baseline]
+    result['improvement_ci_high'] = improvement_high[~is_baseline]
+    result['p_best'] = p_best[~is_baseline]
+    return result.reset_index(drop=True)
+
+
+def compare_configs(all_data_df, baseline_data, n_boot=1000, confidence=0.95, shift=1.0, rng=None):
+    # all_data_df: average time of every (file, parameters), baseline_data: average baseline time of every file
+    rng = rng or np.random.default_rng(0)
+    times = all_data_df.pivot_table(index='parameters', columns='file', values='avg_time')
+    baseline = baseline_data.set_index('file')['avg_time'].reindex(times.columns).to_numpy(dtype=float)
+    config_times = times.to_numpy(dtype=float)
+    # Only the benchmarks both the configuration and the baseline have a time for are compared
+    shared = ~np.isnan(config_times) & ~np.isnan(baseline)[None, :]
+    config_times = np.where(shared, config_times, np.nan)
+    baseline_times = np.where(shared, baseline[None, :], np.nan)
+
+    sgm = shifted_geometric_mean(config_times, shift)
+    sgm_baseline = shifted_geometric_mean(baseline_times, shift)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sgm_improvement = 100 * (1 - sgm / sgm_baseline)
+        p_faster = wilcoxon_faster((config_times - baseline_times) / baseline_times)
+
+    # Bootstrap over benchmarks: the same resampled benchmarks for the configuration and the baseline
+    rows, cols = np.nonzero(shared)
+    counts = np.bincount(rows, minlength=len(times))
+    log_config, _ = pad_groups(rows, np.log(config_times[rows, cols] + shift), len(times))
+    log_baseline, _ = pad_groups(rows, np.log(baseline_times[rows, cols] + shift), len(times))
+    mean_config, mean_baseline = bootstrap_means([log_config, log_baseline], counts, n_boot, rng)
+    low, high = np.full(len(times), np.nan), np.full(len(times), np.nan)
+    compared = counts > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        samples = 100 * (1 - (np.exp(mean_config[compared]) - shift) / (np.exp(mean_baseline[compared]) - shift))
+    if compared.any():
+        low[compared], high[compared] = row_percentiles(samples, [50 * (1 - confidence), 50 * (1 + confidence)])
+
+    return pd.DataFrame({'parameters': times.index, 'sgm_time_all': sgm, 'sgm_time_baseline': sgm_baseline,
+                         'sgm_improvement_all': sgm_improvement, 'sgm_improvement_all_ci_low': low,
+                         'sgm_improvement_all_ci_high': high, 'p_faster_all': p_faster})
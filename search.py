@@ -0,0 +1,121 @@
+# ---------------------------------------------
+# Script: search.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module implements the Bayesian optimization behind run.py's search mode. Instead of running
+# every cell of the alpha x max_iter x prec grid, run.py asks this module for one configuration at a
+# time. Each configuration is scored by its mean improvement over the baseline, and the scores seen
+# so far are used to pick the next one. The model is a Gaussian process with an RBF kernel, written
+# with NumPy only, and the next configuration is the candidate with the highest expected improvement.
+#
+# The search space is given as `(low, high)` ranges: alpha is searched linearly, max_iter over the
+# integers, and prec on a log scale. Proposed values are rounded (alpha to 3 decimals, prec to 2
+# significant digits) so that they stay readable and land on cached builds more often.
+#
+# FUNCTIONS
+# ---------
+# - `to_unit`: Maps configurations to the unit cube the model works in.
+# - `random_configs`: Draws random configurations from the search space.
+# - `mean_improvement`: Scores a configuration by its mean improvement (in %) over the baseline, over the
+#   benchmarks both have results for, the same measure as `mean_improvement_all` in `generate_results`.
+# - `fit_gp`: Fits the Gaussian process to the scores, choosing the length scale and noise level that
+#   maximize the marginal likelihood over a small grid.
+# - `propose`: Returns the next configuration to evaluate. The first `n_initial` proposals are random; after
+#   that, configurations still running are added to the data with the model's predicted score (the
+#   "kriging believer" heuristic), so that several proposals can be evaluated at the same time.
+# ---------------------------------------------
+
+import math
+import numpy as np
+
+LENGTH_SCALES = [0.1, 0.2, 0.3, 0.5, 1.0]
+NOISE_LEVELS = [1e-3, 1e-2, 1e-1]
+NUM_CANDIDATES = 2000
+
+
+def to_unit(configs, space):
+    (alpha_low, alpha_high), (max_iter_low, max_iter_high), (prec_low, prec_high) = space
+    configs = np.asarray(configs, dtype=float).reshape(-1, 3)
+    return np.column_stack([
+        (configs[:, 0] - alpha_low) / (alpha_high - alpha_low),
+        (configs[:, 1] - max_iter_low) / max(max_iter_high - max_iter_low, 1),
+        (np.log10(configs[:, 2]) - math.log10(prec_low)) / (math.log10(prec_high) - math.log10(prec_low)),
+    ])
+
+
+def random_configs(space, n, rng):
+    (alpha_low, alpha_high), (max_iter_low, max_iter_high), (prec_low, prec_high) = space
+    alphas = rng.uniform(alpha_low, alpha_high, n)
+    max_iters = rng.integers(max_iter_low, max_iter_high + 1, n)
+    precs = 10 ** rng.uniform(math.log10(prec_low), math.log10(prec_high), n)
+    return [(round(float(alpha), 3), int(max_iter), float(f"{prec:.2g}"))
+            for alpha, max_iter, prec in zip(alphas, max_iters, precs)]
+
+
+def mean_improvement(config_times, baseline_times):
+    improvements = [100 * (baseline_times[bench] - config_times[bench]) / baseline_times[bench]
+                    for bench in config_times if baseline_times.get(bench)]
+    return float(np.mean(improvements)) if improvements else None
+
+
+def rbf_kernel(a, b, length_scale):
+    distances = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+    return np.exp(-0.5 * distances / length_scale ** 2)
+
+
+def fit_gp(x, y):
+    best = None
+    for length_scale in LENGTH_SCALES:
+        for noise in NOISE_LEVELS:
+            k = rbf_kernel(x, x, length_scale) + noise * np.eye(len(x))
+            try:
+                chol = np.linalg.cholesky(k)
+            except np.linalg.LinAlgError:
+                continue
+            weights = np.linalg.solve(chol.T, np.linalg.solve(chol, y))
+            log_likelihood = -0.5 * y @ weights - np.log(np.diag(chol)).sum()
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length_scale, chol, weights)
+    _, length_scale, chol, weights = best
+    return x, length_scale, chol, weights
+
+
+def predict(gp, x_new):
+    x, length_scale, chol, weights = gp
+    k_new = rbf_kernel(x_new, x, length_scale)
+    mean = k_new @ weights
+    v = np.linalg.solve(chol, k_new.T)
+    variance = np.clip(1.0 - (v ** 2).sum(axis=0), 1e-12, None)
+    return mean, np.sqrt(variance)
+
+
+def expected_improvement(mean, std, best):
+    z = (mean - best) / std
+    cdf = 0.5 * (1 + np.vectorize(math.erf)(z / math.sqrt(2)))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+    return (mean - best) * cdf + std * pdf
+
+
+def propose(observations, running, space, n_initial, rng):
+    # observations: list of (config, score), running: configs that have been proposed but not scored yet
+    seen = {config for config, _ in observations} | set(running)
+    candidates = [config for config in random_configs(space, NUM_CANDIDATES, rng) if config not in seen]
+    if len(observations) + len(running) < n_initial or len(observations) < 2:
+        return candidates[0]
+
+    configs = [config for config, _ in observations]
+    scores = np.array([score for _, score in observations], dtype=float)
+    center, scale = scores.mean(), scores.std() or 1.0
+    x = to_unit(configs, space)
+    y = (scores - center) / scale
+    gp = fit_gp(x, y)
+    if running:
+        believed, _ = predict(gp, to_unit(running, space))
+        x = np.vstack([x, to_unit(running, space)])
+        y = np.concatenate([y, believed])
+        gp = fit_gp(x, y)
+
+    mean, std = predict(gp, to_unit(candidates, space))
+    return candidates[int(np.argmax(expected_improvement(mean, std, y.max())))]
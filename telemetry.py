@@ -0,0 +1,298 @@
+# ---------------------------------------------
+# Script: telemetry.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This module shows how a running campaign is doing. run.py reports every build, every batch of
+# queued jobs and every finished job to a `Telemetry` object, and a background thread refreshes,
+# every `interval` seconds:
+# - a status line on the terminal (rewritten in place; once a minute as a new line when the output
+#   is not a terminal, e.g. redirected to a log file). On a terminal, everything else printed during the
+#   campaign goes through `StatusStream`, which clears the status line, prints the message and redraws the
+#   status line below it,
+# - a JSON metrics file, replaced atomically so readers never see half of it,
+# - optionally the same JSON served over HTTP on `localhost:{port}`.
+#
+# The metrics are: jobs done (with the numbers of timeouts, failures and cancelled jobs), running and
+# queued; jobs per second since the first job was queued; how busy the job slots are (running jobs over
+# slots, averaged since the start) and how busy the machine's CPUs are (from /proc/stat, since the last
+# refresh); the time spent building and the CPU time (user and sys) spent in jobs; the ETA; and, per configuration,
+# the mean improvement over the baseline on the benchmarks both have finished so far (censored runs
+# count as `par_k` times their cutoff, as everywhere else).
+#
+# The ETA is the predicted time of the jobs not done yet (from the per-benchmark baseline times, see
+# `cost_model.py`), divided by the rate at which predicted time has been completed so far by finished jobs
+# (jobs cancelled by racing or a shutdown are dropped from the time left, but do not count as progress). Until the
+# first job finishes, it assumes the slots run at the predicted speed, and without any history it is the
+# number of jobs left divided by the jobs per second.
+#
+# FUNCTIONS
+# ---------
+# - `cpu_times`: Returns the busy and total CPU time of the machine from /proc/stat, or None if unavailable.
+# - `format_duration`: Formats seconds as `1h02m03s`.
+# - `MetricsHandler`: Answers every HTTP GET with the current metrics.
+# - `StatusStream`: Stands in for sys.stdout while the status line is shown on a terminal, so messages of any
+#   thread are not glued to it. It writes whole lines only, which also keeps messages of different threads apart.
+# - `Telemetry`: Collects the state of the campaign and refreshes the status line, the metrics file and the
+#   HTTP endpoint. Used as a context manager around the campaign. `slots` is the number of parallel jobs,
+#   None in distributed mode where it is not known.
+# ---------------------------------------------
+
+import os
+import sys
+import json
+import time
+import threading
+import http.server
+import collections
+from search import mean_improvement
+
+
+def cpu_times():
+    try:
+        with open("/proc/stat") as file:
+            values = [int(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle and iowait are the fourth and fifth values
+    idle = sum(values[3:5])
+    return sum(values) - idle, sum(values)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m{seconds % 60:02d}s"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.telemetry.snapshot(), indent=1).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StatusStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.status = None  # status line currently shown at the bottom of the terminal
+        self.pending = threading.local()  # text of the current thread not ended by a newline yet
+
+    def write(self, text):
+        # Whole lines only, so the text and newline print writes separately stay together across threads
+        pending = getattr(self.pending, "text", "") + text
+        lines, _, self.pending.text = pending.rpartition("\n")
+        if lines:
+            with self.lock:
+                self.stream.write(("\r\x1b[K" if self.status else "") + lines + "\n" + (self.status or ""))
+                self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def show(self, line, final=False):
+        with self.lock:
+            self.stream.write(f"\r{line}\x1b[K" + ("\n" if final else ""))
+            self.stream.flush()
+            self.status = None if final else f"{line}\x1b[K"
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Telemetry:
+    def __init__(self, slots, predicted, par_k, interval=5, metrics_file=None, port=None):
+        self.slots = slots
+        self.predicted = predicted
+        self.par_k = par_k
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.first_queued = None
+        self.outstanding = {}  # future -> predicted time of the jobs not done yet
+        self.counts = collections.Counter()  # done, timeouts, failed, cancelled
+        self.predicted_done = 0.0
+        self.build_seconds = 0.0
+        self.job_seconds = 0.0
+        self.busy_samples = []
+        self.cpu_sample = cpu_times()
+        self.cpu_busy = None
+        self.configs = {}  # loop number -> parameters
+        self.times = collections.defaultdict(lambda: collections.defaultdict(list))  # (is_baseline, loop) -> bench -> times
+        self.stop = threading.Event()
+        self.last_line = 0.0
+        self.stream = None
+        self.thread = threading.Thread(target=self.report, daemon=True)
+        self.server = None
+        if port is not None:
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.server.telemetry = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def __enter__(self):
+        if self.interval:
+            if sys.stdout.isatty():
+                self.stream = StatusStream(sys.stdout)
+                sys.stdout = self.stream
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.interval:
+            self.refresh(final=True)
+        if self.stream is not None:
+            sys.stdout = self.stream.stream
+            sys.stdout.write(getattr(self.stream.pending, "text", ""))
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def timed_build(self, build, *args):
+        start = time.monotonic()
+        try:
+            return build(*args)
+        finally:
+            with self.lock:
+                self.build_seconds += time.monotonic() - start
+
+    def queued(self, futures):
+        with self.lock:
+            if self.first_queued is None and futures:
+                self.first_queued = time.monotonic()
+            for future, job in futures.items():
+                self.outstanding[future] = self.predicted.get(job[0], 0.0)
+
+    def finished(self, future, job, result):
+        file_path, run, loop_number, is_baseline, alpha, max_iter, prec, binary = job
+        with self.lock:
+            predicted = self.outstanding.pop(future, 0.0)
+            if result is None:
+                # Cancelled by racing or a shutdown: no longer left to do, but not done either, so the rate is not credited
+                self.counts["cancelled"] += 1
+                return
+            self.predicted_done += predicted
+            self.counts["done"] += 1
+            self.job_seconds += (result.get("user_time") or 0.0) + (result.get("sys_time") or 0.0)
+            if result["timed_out"]:
+                self.counts["timeouts"] += 1
+                time_value = self.par_k * result["cutoff"]
+            elif result["cpu_time"] is None:
+                self.counts["failed"] += 1
+                return
+            else:
+                time_value = result["cpu_time"]
+            self.configs[(is_baseline, loop_number)] = (alpha, max_iter, prec)
+            self.times[(is_baseline, loop_number)][file_path].append(time_value)
+
+    def improvements(self):
+        # Called with the lock held
+        def means(config):
+            return {bench: sum(values) / len(values) for bench, values in self.times[config].items()}
+        baseline = means((True, 1))
+        improvements = []
+        for (is_baseline, loop_number), (alpha, max_iter, prec) in sorted(self.configs.items()):
+            if is_baseline:
+                continue
+            config = means((False, loop_number))
+            improvements.append({"loop": loop_number, "alpha": alpha, "max_iter": max_iter, "prec": prec,
+                                 "benchmarks": sum(1 for bench in config if baseline.get(bench)),
+                                 "improvement": mean_improvement(config, baseline)})
+        return improvements
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            outstanding = list(self.outstanding.items())
+            running = sum(1 for future, _ in outstanding if future.running())
+            remaining = sum(predicted for _, predicted in outstanding)
+            elapsed = now - self.first_queued if self.first_queued is not None else 0.0
+            if self.predicted_done > 0 and elapsed > 0:
+                eta = remaining / (self.predicted_done / elapsed)
+            elif self.counts["done"] > 0 and elapsed > 0:
+                # No history for the benchmarks done so far: every job is assumed to take as long as the average one
+                eta = len(outstanding) / (self.counts["done"] / elapsed)
+            elif self.slots and remaining > 0:
+                eta = remaining / self.slots
+            else:
+                eta = None
+            return {
+                "elapsed": round(now - self.start_time, 1),
+                "jobs_done": self.counts["done"],
+                "jobs_timed_out": self.counts["timeouts"],
+                "jobs_failed": self.counts["failed"],
+                "jobs_cancelled": self.counts["cancelled"],
+                "jobs_running": running,
+                "jobs_queued": len(outstanding) - running,
+                "jobs_per_s": round(self.counts["done"] / elapsed, 3) if elapsed > 0 else None,
+                "slots": self.slots,
+                "slots_busy": round(sum(self.busy_samples) / len(self.busy_samples), 3) if self.busy_samples else None,
+                "cpu_busy": None if self.cpu_busy is None else round(self.cpu_busy, 3),
+                "build_seconds": round(self.build_seconds, 1),
+                "job_cpu_seconds": round(self.job_seconds, 1),
+                "eta_seconds": None if eta is None else round(eta, 1),
+                "configs": self.improvements(),
+            }
+
+    def sample(self):
+        with self.lock:
+            if self.slots and self.first_queued is not None:
+                running = sum(1 for future in self.outstanding if future.running())
+                self.busy_samples.append(min(1.0, running / self.slots))
+            sample = cpu_times()
+            if sample is not None and self.cpu_sample is not None and sample[1] > self.cpu_sample[1]:
+                self.cpu_busy = (sample[0] - self.cpu_sample[0]) / (sample[1] - self.cpu_sample[1])
+            self.cpu_sample = sample
+
+    def status_line(self, metrics):
+        line = (f"[{format_duration(metrics['elapsed'])}] {metrics['jobs_done']} done, {metrics['jobs_running']} running, "
+                f"{metrics['jobs_queued']} queued")
+        problems = [f"{metrics[key]} {name}" for key, name in
+                    [("jobs_timed_out", "timed out"), ("jobs_failed", "failed"), ("jobs_cancelled", "cancelled")] if metrics[key]]
+        if problems:
+            line += f" ({', '.join(problems)})"
+        if metrics["jobs_per_s"] is not None:
+            line += f" | {metrics['jobs_per_s']:.2f} jobs/s"
+        if metrics["slots_busy"] is not None:
+            line += f" | slots {100 * metrics['slots_busy']:.0f}%"
+        if metrics["cpu_busy"] is not None:
+            line += f" | CPU {100 * metrics['cpu_busy']:.0f}%"
+        line += f" | build {format_duration(metrics['build_seconds'])}, job CPU {format_duration(metrics['job_cpu_seconds'])}"
+        line += f" | ETA {format_duration(metrics['eta_seconds'])}"
+        scored = [config for config in metrics["configs"] if config["improvement"] is not None]
+        if scored:
+            best = max(scored, key=lambda config: config["improvement"])
+            line += f" | best loop {best['loop']} {best['improvement']:+.1f}% on {best['benchmarks']}"
+        return line
+
+    def refresh(self, final=False):
+        self.sample()
+        metrics = self.snapshot()
+        if self.metrics_file:
+            with open(self.metrics_file + ".tmp", "w") as file:
+                json.dump(metrics, file, indent=1)
+            os.replace(self.metrics_file + ".tmp", self.metrics_file)
+        line = self.status_line(metrics)
+        if self.stream is not None:
+            self.stream.show(line, final)
+        elif final or time.monotonic() - self.last_line >= 60:
+            print(line, flush=True)
+            self.last_line = time.monotonic()
+
+    def report(self):
+        while not self.stop.wait(self.interval):
+            self.refresh()
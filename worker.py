@@ -0,0 +1,183 @@
+# ---------------------------------------------
+# Script: worker.py
+# ---------------------------------------------
+#
+# OVERVIEW
+# --------
+# This script runs the jobs of a distributed campaign on another machine. It connects to the
+# coordinator started by run.py in distributed mode (see `coordinator.py`), fetches jobs, downloads
+# the `ibexopt` binary of each configuration and the benchmark files the first time they are needed,
+# runs the jobs the same way run.py does locally and sends the parsed results back. The raw output
+# of every run stays on the worker, in `{work_dir}/outputs`, archived like run.py's (see `output_archive.py`)
+# unless the campaign runs with `archive_outputs` off.
+#
+# While a job runs, its lease is renewed every third of the lease time. If the worker dies, the
+# coordinator queues its jobs again once their leases run out. If the coordinator cannot be reached
+# for `--reconnect` seconds, the worker gives up, so workers stop by themselves after the campaign.
+#
+# FUNCTIONS
+# ---------
+# - `send_request`: Sends one request to the coordinator and returns its answer.
+# - `fetch_file`: Downloads a binary or benchmark file into the worker's cache, unless it is already there.
+# - `renew_lease`: Renews the lease of a running job until the job is done.
+# - `run_job`: Runs one job with `run_ibexopt` from ibexopt_runner.py and returns its result.
+# - `work`: Fetches and runs jobs one after another; `--jobs` of these run in parallel threads.
+# - `main`: Parses the command line and starts the worker threads.
+#
+# PARAMETERS
+# ----------
+# - `--coordinator`: Address of the coordinator as `host:port`.
+# - `--token`: Shared secret of the coordinator (run.py's `coordinator_token`), defaults to the `COORDINATOR_TOKEN`
+#   environment variable, which unlike the command line is not visible to other users of the machine.
+# - `--jobs`: Number of jobs to run in parallel, defaults to the number of CPUs.
+# - `--work_dir`: Directory for downloaded files and outputs, defaults to `worker`.
+# - `--name`: Name of the worker, defaults to the host name and process id.
+# - `--pin_jobs`: Pin every job to its own physical core, as run.py's `pin_jobs` does. `--jobs` is then the
+#   number of free cores. Required if, and only if, the campaign runs with `pin_jobs`.
+# - `--reserved_cpus`: CPUs kept free for the worker itself when pinning, defaults to `0`.
+# - `--poll`: Seconds to wait before asking again when the queue is empty, defaults to 1.
+# - `--reconnect`: Seconds to keep trying when the coordinator cannot be reached, defaults to 60.
+# ---------------------------------------------
+
+import os
+import json
+import time
+import base64
+import socket
+import argparse
+import threading
+from multiprocessing import cpu_count
+from ibexopt_runner import run_ibexopt, output_name
+from output_archive import output_reference, archive_path
+from pinning import pin_harness
+
+download_lock = threading.Lock()
+coordinator_token = None  # sent with every request, set from --token
+
+
+def send_request(address, request, timeout=60):
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall((json.dumps(dict(request, token=coordinator_token)) + "\n").encode())
+        with sock.makefile("rb") as reply:
+            response = json.loads(reply.readline())
+    if response["type"] == "error":
+        raise RuntimeError(f"Coordinator error: {response['error']}")
+    return response
+
+
+def fetch_file(address, kind, name, path, executable=False):
+    with download_lock:
+        if not os.path.exists(path):
+            response = send_request(address, {"type": kind, "name": name})
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name first so an interrupted download is never used
+            with open(path + ".tmp", "wb") as file:
+                file.write(base64.b64decode(response["data"]))
+            if executable:
+                os.chmod(path + ".tmp", 0o755)
+            os.replace(path + ".tmp", path)
+    return path
+
+
+def renew_lease(address, worker, job, finished):
+    while not finished.wait(job["lease_seconds"] / 3):
+        try:
+            if not send_request(address, {"type": "renew", "worker": worker, "id": job["id"]})["ok"]:
+                print(f"Lost the lease of job {job['id']}, another worker will run it too")
+                return
+        except OSError:
+            # The coordinator may be back before the lease runs out
+            pass
+
+
+def run_job(address, worker, work_dir, job, pinning):
+    binary = fetch_file(address, "binary", job["binary_hash"],
+                        os.path.join(work_dir, "build_cache", job["binary_hash"], "ibexopt"), executable=True)
+    bench = fetch_file(address, "bench", job["bench"], os.path.join(work_dir, "benchs", f"{job['bench']}.bch"))
+    name = output_name(job["bench"], job["run"], job["is_baseline"], job["alpha"], job["max_iter"], job["prec"])
+    if job["archive"] is not None:
+        output_file = output_reference(archive_path(os.path.join(work_dir, "outputs"), job["archive"]), job["bench"], name)
+    else:
+        output_file = os.path.join(work_dir, "outputs", name)
+    cmd = [binary, bench, f"--random-seed={job['seed']}"]
+    finished = threading.Event()
+    renewer = threading.Thread(target=renew_lease, args=(address, worker, job, finished), daemon=True)
+    renewer.start()
+    try:
+        result = run_ibexopt(cmd, output_file, job["cutoff"], pinning)
+    finally:
+        finished.set()
+    result["output_file"] = f"{worker}:{result['output_file']}"
+    return result
+
+
+def work(address, worker, work_dir, pinning, poll, reconnect):
+    last_contact = time.monotonic()
+    result = None
+    while True:
+        try:
+            if result is not None:
+                send_request(address, result)
+                result = None
+            job = send_request(address, {"type": "fetch", "worker": worker, "pinned": pinning is not None})
+            last_contact = time.monotonic()
+        except RuntimeError as error:
+            print(error)
+            return
+        except OSError:
+            if time.monotonic() - last_contact > reconnect:
+                print(f"Coordinator unreachable for {reconnect}s, stopping")
+                return
+            time.sleep(poll)
+            continue
+
+        if job["type"] == "done":
+            return
+        if job["type"] == "wait":
+            time.sleep(poll)
+            continue
+        result = {"type": "result", "worker": worker, "id": job["id"]}
+        try:
+            result["result"] = run_job(address, worker, work_dir, job, pinning)
+        except Exception as error:
+            # The coordinator queues the job again for another worker, and records it as failed after a few attempts
+            result["error"] = f"{type(error).__name__}: {error}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coordinator', type=str, required=True)
+    parser.add_argument('--token', type=str, default=os.environ.get('COORDINATOR_TOKEN'))
+    parser.add_argument('--jobs', type=int, default=cpu_count())
+    parser.add_argument('--work_dir', type=str, default='worker')
+    parser.add_argument('--name', type=str, default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument('--pin_jobs', action='store_true')
+    parser.add_argument('--reserved_cpus', type=int, nargs='*', default=[0])
+    parser.add_argument('--poll', type=float, default=1.0)
+    parser.add_argument('--reconnect', type=float, default=60.0)
+    args = parser.parse_args()
+
+    global coordinator_token
+    coordinator_token = args.token
+    host, port = args.coordinator.rsplit(":", 1)
+    address = (host, int(port))
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(os.path.join(work_dir, "outputs"), exist_ok=True)
+
+    pinning = None
+    num_jobs = args.jobs
+    if args.pin_jobs:
+        pinning = pin_harness(set(args.reserved_cpus), True)
+        num_jobs = pinning[0].qsize()
+    print(f"Worker {args.name} running {num_jobs} jobs at a time for {args.coordinator}")
+
+    threads = [threading.Thread(target=work, args=(address, args.name, work_dir, pinning, args.poll, args.reconnect))
+               for _ in range(num_jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()